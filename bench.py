@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+"""
+Squidpeek benchmarks
+
+Generates a synthetic log (or uses the one given), then runs each benchmark
+in its own process and reports how fast it went and its peak memory use.
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import sys
+import os
+import time
+import json
+import resource
+import subprocess
+import tempfile
+
+
+def bench_parse(path):
+    "AccessParser, reading the log line by line"
+    from squidpeek_lib.squidlog import AccessParser
+    log = AccessParser(open(path))
+    for line in log:
+        pass
+    return log.num_processed
+
+def bench_parse_mmap(path):
+    "MmapAccessParser, scanning the memory-mapped log"
+    from squidpeek_lib.squidlog import MmapAccessParser
+    log = MmapAccessParser(open(path))
+    for line in log:
+        pass
+    return log.num_processed
+
+def bench_aggregate(path, **summary_args):
+    "LogSummary.parse(), as main() does"
+    import squidpeek
+    summary = squidpeek.LogSummary(**summary_args)
+    summary.parse(open(path))
+    return summary.num_processed
+
+def bench_aggregate_sketch(path):
+    "LogSummary.parse() with --sketch 1024"
+    return bench_aggregate(path, sketch_kb=1024)
+
+def bench_hot_urls(path):
+    "SpaceSaving (which replaced CacheDict), tracking the URLs in the log"
+    from squidpeek_lib.squidlog import MmapAccessParser
+    from squidpeek_lib.spacesaving import SpaceSaving
+    urls = [line['url'] for line in MmapAccessParser(open(path))]
+    hot_urls = SpaceSaving(2000)
+    start = time.time()
+    for url in urls:
+        if hot_urls.add(url) is None:
+            hot_urls[url] = None
+    return len(urls), time.time() - start
+
+def bench_sparkbar(path, num=20000):
+    "Sparkbar images"
+    from squidpeek_lib.sparkbar import Sparkbar
+    import random
+    rand = random.Random(0)
+    for i in xrange(num):
+        bar = Sparkbar()
+        bar.append(rand.randint(0, 1000), "a", (32,128,32,255))
+        bar.append(rand.randint(1, 1000), "b", (128,32,32,255))
+        bar.image()
+    return num
+
+def bench_sparkogram(path, num=5000):
+    "Sparkogram images"
+    from squidpeek_lib.sparkogram import Sparkogram
+    import random
+    rand = random.Random(0)
+    for i in xrange(num):
+        sp = Sparkogram(0, 1000)
+        for j in xrange(50):
+            sp.append(int(rand.paretovariate(1)))
+        sp.img()
+    return num
+
+def bench_histogram(path, num=5000):
+    "LogHistogram images (miss times and sizes)"
+    from squidpeek_lib.loghistogram import LogHistogram
+    import random
+    rand = random.Random(0)
+    for i in xrange(num):
+        hist = LogHistogram()
+        for j in xrange(50):
+            hist.append(int(rand.lognormvariate(4.5, 1)))
+        hist.img(1000)
+    return num
+
+def bench_report(path, num_urls=1000):
+    "report() on the top 1000 URLs, after aggregating"
+    import squidpeek
+    from squidpeek_lib.reportwriter import ReportWriter
+    summary = squidpeek.LogSummary(num_urls)
+    summary.parse(open(path))
+    start = time.time()
+    out = ReportWriter(fh=open(os.devnull, 'w'))
+    squidpeek.report(summary, num_urls, out=out)
+    out.close()
+    return min(num_urls, len(summary.hot_urls)), time.time() - start
+
+benchmarks = [
+    ('parse', bench_parse, 'lines'),
+    ('parse-mmap', bench_parse_mmap, 'lines'),
+    ('aggregate', bench_aggregate, 'lines'),
+    ('aggregate-sketch', bench_aggregate_sketch, 'lines'),
+    ('hot-urls', bench_hot_urls, 'lines'),
+    ('sparkbar', bench_sparkbar, 'images'),
+    ('sparkogram', bench_sparkogram, 'images'),
+    ('histogram', bench_histogram, 'images'),
+    ('report', bench_report, 'rows'),
+]
+
+
+def run_one(name, path):
+    """
+    Run the benchmark called name on the log at path, and print the results
+    as JSON.
+    """
+    func = dict([(b[0], b[1]) for b in benchmarks])[name]
+    start = time.time()
+    cpu_start = time.clock()
+    result = func(path)
+    if isinstance(result, tuple): # it timed itself
+        count, seconds = result
+    else:
+        count, seconds = result, time.time() - start
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss /= 1024 # bytes, not kilobytes
+    print json.dumps({
+        'name': name,
+        'count': count,
+        'seconds': seconds,
+        'cpu': time.clock() - cpu_start,
+        'rate': count / max(seconds, 1e-9),
+        'max_rss_kb': max_rss,
+    })
+
+def run_all(path, names, baseline=None):
+    "Run the named benchmarks in turn, printing and returning their results."
+    results = {}
+    print "%-18s %10s %8s %14s %10s" % ("benchmark", "count", "seconds", "rate/sec", "peak RSS")
+    for name, func, unit in benchmarks:
+        if names and name not in names:
+            continue
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                 '--run', name, path], stdout=subprocess.PIPE)
+        output = proc.communicate()[0]
+        if proc.returncode != 0:
+            print "%-18s failed" % name
+            continue
+        result = json.loads(output.strip().split('\n')[-1])
+        results[name] = result
+        line = "%-18s %10i %8.2f %8i %-5s %8.1fM" % (
+            name, result['count'], result['seconds'], result['rate'], unit,
+            result['max_rss_kb'] / 1024.0)
+        if baseline and baseline.has_key(name):
+            change = result['rate'] / baseline[name]['rate'] - 1
+            line += " %+5.0f%%" % (change * 100)
+            if change < -0.1:
+                line += " SLOWER"
+        print line
+        sys.stdout.flush()
+    return results
+
+def usage():
+    print """\
+Usage: %s [options] [benchmark ...]
+  -l file         Use this log instead of generating one
+  -n num          Number of lines to generate (default: 200000)
+  -u num          Number of distinct URLs to generate (default: 20000)
+  -s skew         Zipf exponent for URL popularity (default: 1.0)
+  -q fraction     Fraction of requests with a query string (default: 0.3)
+  -k fraction     Fraction of lines with a Link header field (default: 0.0)
+  -o file         Save the results to file, as JSON
+  -c file         Compare the results with ones saved earlier
+  benchmark       %s
+""" % (sys.argv[0], ", ".join([b[0] for b in benchmarks]))
+    sys.exit(1)
+
+if __name__ == '__main__':
+    import getopt
+    if sys.argv[1:2] == ['--run']:
+        run_one(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "l:n:u:s:q:k:o:c:h")
+    except getopt.GetoptError:
+        usage()
+    opts = dict(opts)
+    if opts.has_key('-h') or [a for a in args if a not in [b[0] for b in benchmarks]]:
+        usage()
+    path = opts.get('-l', None)
+    tmp_path = None
+    if path is None:
+        from squidpeek_lib.loggen import generate
+        fd, tmp_path = tempfile.mkstemp(suffix='.log', prefix='squidpeek-bench')
+        out = os.fdopen(fd, 'w')
+        for line in generate(int(opts.get('-n', 200000)),
+                             num_urls=int(opts.get('-u', 20000)),
+                             skew=float(opts.get('-s', 1.0)),
+                             query_fraction=float(opts.get('-q', 0.3)),
+                             link_fraction=float(opts.get('-k', 0.0))):
+            out.write(line + "\n")
+        out.close()
+        path = tmp_path
+    baseline = None
+    if opts.has_key('-c'):
+        baseline = json.load(open(opts['-c']))
+    try:
+        results = run_all(path, args, baseline)
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
+    if opts.has_key('-o'):
+        json.dump(results, open(opts['-o'], 'w'), indent=1)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+"""
+canvas.py - Image backends for sparklines
+
+Sparklines only need filled boxes on a small image, so they're drawn on a
+Canvas from new_canvas(), which can be:
+
+  png - PNG images, encoded here (the default)
+  svg - SVG images
+  pil - PNG images, drawn with the Python Imaging Library
+
+All of them return a data: URI for use in an IMG tag.
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+import base64
+import struct
+import urllib
+import zlib
+
+_backend = 'png'
+_uris = {} # (backend, width, height, fills) -> data: URI
+cache_size = 10000
+images_drawn = 0
+images_reused = 0 # from the cache
+
+def set_backend(name):
+    "Use the backend called name for new canvases."
+    global _backend
+    if not backends.has_key(name):
+        raise ValueError, "unknown image backend %s" % name
+    if name == 'pil':
+        from PIL import Image # fail early if it isn't installed
+    _backend = name
+
+def get_backend():
+    "Return the name of the backend used for new canvases."
+    return _backend
+
+def new_canvas(width, height, bg_color=(255,255,255,0)):
+    """
+    Return a blank width x height canvas from the current backend.
+    Colors are (red, green, blue[, alpha]) tuples.
+    """
+    return backends[_backend](width, height, bg_color)
+
+
+class Canvas(object):
+    """
+    A width x height image, filled with boxes. They're only drawn when
+    data_uri() is called, and then only if an identical image hasn't been
+    drawn recently; otherwise, the same URI is returned again.
+    """
+    __slots__ = ['width', 'height', 'fills']
+    name = None
+
+    def __init__(self, width, height, bg_color=(255,255,255,0)):
+        self.width = width
+        self.height = height
+        self.fills = [(0, 0, width - 1, height - 1, _rgba(bg_color))]
+
+    def fill(self, x0, y0, x1, y1, color):
+        "Fill the box from (x0, y0) to (x1, y1), inclusive, with color."
+        self.fills.append((x0, y0, x1, y1, _rgba(color)))
+
+    def data_uri(self):
+        global images_drawn, images_reused
+        key = (self.name, self.width, self.height, tuple(self.fills))
+        try:
+            uri = _uris[key]
+            images_reused += 1
+            return uri
+        except KeyError:
+            if len(_uris) >= cache_size:
+                _uris.clear()
+            uri = _uris[key] = self.render()
+            images_drawn += 1
+            return uri
+
+    def render(self):
+        "Draw the image, and return it as a data: URI."
+        raise NotImplementedError
+
+
+class PngCanvas(Canvas):
+    """
+    A canvas that's encoded as a palette-based PNG, without any help.
+    """
+    __slots__ = []
+    name = 'png'
+
+    def render(self):
+        width, height = self.width, self.height
+        palette = []
+        pixels = [bytearray(width) for y in xrange(height)]
+        for x0, y0, x1, y1, color in self.fills:
+            x0, x1 = max(x0, 0), min(x1, width - 1)
+            if x1 < x0:
+                continue
+            try:
+                index = palette.index(color)
+            except ValueError:
+                index = len(palette)
+                palette.append(color)
+            row = bytearray(chr(index) * (x1 - x0 + 1))
+            for y in xrange(max(y0, 0), min(y1, height - 1) + 1):
+                pixels[y][x0:x1 + 1] = row
+        raw = ''.join(['\x00' + str(row) for row in pixels]) # no filtering
+        alphas = ''.join([chr(c[3]) for c in palette]).rstrip('\xff')
+        png = ['\x89PNG\r\n\x1a\n',
+               _chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)),
+               _chunk('PLTE', ''.join([struct.pack('BBB', *c[:3]) for c in palette]))]
+        if alphas:
+            png.append(_chunk('tRNS', alphas))
+        png.append(_chunk('IDAT', zlib.compress(raw)))
+        png.append(_chunk('IEND', ''))
+        return "data:image/png;base64,%s" % base64.b64encode(''.join(png))
+
+def _chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + \
+      struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+def _rgba(color):
+    if len(color) == 3:
+        return tuple(color) + (255,)
+    return tuple(color)
+
+
+class SvgCanvas(Canvas):
+    """
+    A canvas that's drawn as SVG; consecutive boxes of the same color are
+    drawn as one path. Unlike the others, filling with a transparent color
+    doesn't erase what's underneath.
+    """
+    __slots__ = []
+    name = 'svg'
+
+    def render(self):
+        paths = [] # [color, [box, ...]]
+        for x0, y0, x1, y1, color in self.fills:
+            x0, x1 = max(x0, 0), min(x1, self.width - 1)
+            y0, y1 = max(y0, 0), min(y1, self.height - 1)
+            if x1 < x0 or y1 < y0 or not color[3]:
+                continue
+            box = "M%i,%ih%iv%ih%iz" % (x0, y0, x1 - x0 + 1, y1 - y0 + 1, x0 - x1 - 1)
+            if paths and paths[-1][0] == color:
+                paths[-1][1].append(box)
+            else:
+                paths.append([color, [box]])
+        shapes = []
+        for color, boxes in paths:
+            if color[3] < 255:
+                opacity = " fill-opacity='%.2f'" % (color[3] / 255.0)
+            else:
+                opacity = ""
+            shapes.append("<path fill='#%02x%02x%02x'%s d='%s'/>" % (
+                color[0], color[1], color[2], opacity, "".join(boxes)))
+        svg = "<svg xmlns='http://www.w3.org/2000/svg' width='%i' height='%i' shape-rendering='crispEdges'>%s</svg>" % (
+            self.width, self.height, "".join(shapes))
+        return "data:image/svg+xml,%s" % urllib.quote(svg, "/:=,.<>")
+
+
+class PilCanvas(Canvas):
+    """
+    A canvas that's drawn with the Python Imaging Library; see
+    <http://www.pythonware.com/products/pil/>.
+    """
+    __slots__ = []
+    name = 'pil'
+
+    def render(self):
+        from PIL import Image, ImageDraw
+        import StringIO
+        bg_color = self.fills[0][4]
+        image = Image.new("RGBA", (self.width, self.height), bg_color)
+        draw = ImageDraw.Draw(image)
+        for x0, y0, x1, y1, color in self.fills[1:]:
+            draw.rectangle([(x0, y0), (x1, y1)], fill=color)
+        f = StringIO.StringIO()
+        image.save(f, "PNG")
+        return "data:image/png;base64,%s" % base64.b64encode(f.getvalue())
+
+
+class ImageSheet(object):
+    """
+    The images in a page. Each distinct image is given a CSS class, and
+    included once, in the page's stylesheet, no matter how many times it's
+    shown. Images that are width x height (the usual size) don't need to
+    say so in their own rules.
+    """
+    def __init__(self, prefix='spark', width=80, height=20):
+        self.prefix = prefix
+        self.size = (width, height)
+        self.seen = {} # uri -> class name
+        self.rules = []
+        self.repeats = 0 # how many times an image was shown again
+
+    def img(self, uri, title, width=80, height=20):
+        """
+        Return an HTML element showing the image at uri (width x height) 
+        with title.
+        """
+        try:
+            name = self.seen[uri]
+            self.repeats += 1
+        except KeyError:
+            name = self.seen[uri] = "%s%i" % (self.prefix, len(self.rules))
+            if (width, height) == self.size:
+                size = ""
+            else:
+                size = " width: %ipx; height: %ipx;" % (width, height)
+            self.rules.append(
+              ".%s { background-image: url(\"%s\");%s }" % (name, uri, size))
+        return "<span class='%s %s' title='%s'></span>" % (self.prefix, name, title)
+
+    def css(self):
+        "Return CSS rules for the images."
+        rules = [".%s { display: inline-block; width: %ipx; height: %ipx; }" % (
+            (self.prefix,) + self.size)]
+        return "\n".join(rules + self.rules)
+
+
+backends = {
+    'png': PngCanvas,
+    'svg': SvgCanvas,
+    'pil': PilCanvas,
+}
+
+
+def test():
+    for name in ['png', 'svg']:
+        canvas = backends[name](80, 20)
+        canvas.fill(0, 0, 20, 19, (32,128,32,255))
+        canvas.fill(21, 5, 40, 19, (128,32,32))
+        print "<img src=\"%s\"/>" % canvas.data_uri()
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""
+countmin.py - Frequency estimator
+
+See Cormode and Muthukrishnan, "An Improved Data Stream Summary: The
+Count-Min Sketch and its Applications".
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+from array import array
+from struct import Struct
+
+_hashes = [Struct('<%iI' % depth) for depth in xrange(5)]
+
+
+class CountMinSketch(object):
+    """
+    Estimate how many times each value has been seen, in a fixed amount of
+    memory (width * depth counters). Estimates never undercount; with N
+    values counted in total, they overcount by more than about 2.7 * N /
+    width with a probability of about 0.37 ** depth.
+
+    Values are counted as hashes (at least 4 * depth bytes long, e.g. an
+    MD5 digest), not as the values themselves; depth can be at most 4.
+    """
+    __slots__ = ['width', 'depth', 'table']
+
+    def __init__(self, width=65536, depth=4):
+        if not 0 < depth <= 4:
+            raise ValueError, "depth must be between 1 and 4"
+        self.width = width
+        self.depth = depth
+        self.table = array('I', [0]) * (width * depth)
+
+    @classmethod
+    def from_size(cls, kbytes, depth=4):
+        "Make a CountMinSketch that uses about kbytes of memory."
+        width = kbytes * 1024 / (depth * array('I').itemsize)
+        return cls(max(width, 1), depth)
+
+    def _cells(self, digest):
+        width = self.width
+        hashes = _hashes[self.depth].unpack(digest[:4 * self.depth])
+        return [row * width + hashes[row] % width for row in xrange(self.depth)]
+
+    def add(self, digest, count=1):
+        table = self.table
+        for cell in self._cells(digest):
+            table[cell] += count
+
+    def estimate(self, digest):
+        table = self.table
+        return min([table[cell] for cell in self._cells(digest)])
+
+    def estimate_mean(self, digest, total=None):
+        """
+        Estimate how many times digest was seen, taking away the share of
+        everything else counted (total, if it's already known) that each of
+        its cells can expect to have; unlike estimate(), this can
+        undercount, but it doesn't overcount when many values are rare.
+        """
+        if total is None:
+            total = self.total()
+        width = self.width
+        table = self.table
+        found = [table[cell] for cell in self._cells(digest)]
+        estimates = [count - (total - count) / float(width - 1) for count in found]
+        estimates.sort()
+        middle = len(estimates) / 2
+        median = (estimates[middle] + estimates[(len(estimates) - 1) / 2]) / 2
+        return max(0, min(int(round(median)), min(found)))
+
+    def total(self):
+        "Return how many times values have been counted, in all."
+        return sum(self.table[:self.width])
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError, "Can't merge CountMinSketches of different sizes"
+        table = self.table
+        for cell, count in enumerate(other.table):
+            if count:
+                table[cell] += count
+
+
+def test():
+    import hashlib
+    import random
+    cms = CountMinSketch(1000)
+    seen = {}
+    for i in xrange(100000):
+        value = str(int(random.paretovariate(1)))
+        seen[value] = seen.get(value, 0) + 1
+        cms.add(hashlib.md5(value).digest())
+    for value in ['1', '2', '10', '100']:
+        print "%4s: %6i actual: %i" % (
+            value, cms.estimate(hashlib.md5(value).digest()), seen.get(value, 0))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""
+history.py - Per-URL aggregates from many reports, kept in SQLite
+
+Each summary recorded is a period, named by the time its log starts;
+recording a period again (e.g., when resuming with --state as the log
+grows) replaces what was there.
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+import heapq
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS periods (
+    period INTEGER PRIMARY KEY, -- the first line's time, in seconds since the epoch
+    period_end INTEGER NOT NULL,
+    lines INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    distinct_urls INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    accesses INTEGER NOT NULL,
+    error INTEGER NOT NULL, -- how much accesses could be overestimated by
+    hits INTEGER NOT NULL,
+    misses INTEGER NOT NULL,
+    server_errors INTEGER NOT NULL,
+    elapsed_median REAL,
+    elapsed_p95 REAL,
+    kbytes REAL NOT NULL,
+    kbytes_median REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS urls_url_period ON urls (url, period);
+CREATE INDEX IF NOT EXISTS urls_period ON urls (period);
+"""
+
+URL_COLUMNS = ['url', 'period', 'accesses', 'error', 'hits', 'misses',
+               'server_errors', 'elapsed_median', 'elapsed_p95', 'kbytes',
+               'kbytes_median']
+
+
+class History(object):
+    """
+    A SQLite database at path of per-URL aggregates, one row for each URL
+    in each period; raises IOError if path isn't one. Counts of hits, misses and so on only cover 
+    accesses - error of the accesses, as in the report.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str # URLs are bytes, and needn't be UTF-8
+        try:
+            self.db.executescript(SCHEMA)
+        except sqlite3.DatabaseError, why:
+            self.db.close()
+            raise IOError, "%s: %s" % (path, why)
+
+    def close(self):
+        self.db.close()
+
+    def record(self, period, period_end, lines, errors, distinct_urls, rows):
+        """
+        Replace the period starting at period with rows, an iterable of 
+        tuples with the values of URL_COLUMNS other than period.
+        """
+        period = int(period)
+        with self.db:
+            self.db.execute("DELETE FROM urls WHERE period = ?", (period,))
+            self.db.execute("INSERT OR REPLACE INTO periods VALUES (?, ?, ?, ?, ?)",
+                            (period, int(period_end), lines, errors, distinct_urls))
+            self.db.executemany("INSERT INTO urls VALUES (%s)" % ", ".join("?" * len(URL_COLUMNS)),
+                                ((row[0], period) + tuple(row[1:]) for row in rows))
+
+    def periods(self, since=None):
+        "Return a list of the (period, period_end)s from since on, in order."
+        return self.db.execute("SELECT period, period_end FROM periods WHERE period >= ? "
+                               "ORDER BY period", (since or 0,)).fetchall()
+
+    def busiest(self, since=None, limit=100):
+        "Return the limit URLs with the most accesses from since on, busiest first."
+        return [row[0] for row in self.db.execute(
+            "SELECT url FROM urls WHERE period >= ? GROUP BY url "
+            "ORDER BY SUM(accesses) DESC LIMIT ?", (since or 0, limit))]
+
+    def movers(self, since=None, limit=100):
+        """
+        Return the limit URLs whose accesses per second changed the most
+        between the latest period and the ones from since up to it, as a
+        list of (url, rate before, latest rate), biggest change first.
+        """
+        periods = self.periods(since)
+        if len(periods) < 2:
+            return []
+        latest, latest_end = periods[-1]
+        latest_secs = max(latest_end - latest, 1)
+        before_secs = max(sum([end - start for start, end in periods[:-1]]), 1)
+        rates = [(url, before / float(before_secs), now / float(latest_secs)) 
+                 for url, before, now in self.db.execute(
+            "SELECT url, SUM(CASE WHEN period < ? THEN accesses ELSE 0 END), "
+            "SUM(CASE WHEN period = ? THEN accesses ELSE 0 END) "
+            "FROM urls WHERE period >= ? GROUP BY url", (latest, latest, periods[0][0]))]
+        return heapq.nlargest(limit, rates, lambda rate: abs(rate[2] - rate[1]))
+
+    def trend(self, url, since=None):
+        "Return a list of the rows (as dicts) for url from since on, in order."
+        return [dict(zip(URL_COLUMNS, row)) for row in self.db.execute(
+            "SELECT %s FROM urls WHERE url = ? AND period >= ? ORDER BY period" % 
+            ", ".join(URL_COLUMNS), (url, since or 0))]
+
+
+def test():
+    import os
+    import tempfile
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    history = History(path)
+    for hour in xrange(24):
+        period = 1380000000 + hour * 3600
+        history.record(period, period + 3599, 1000, 0, 2, [
+            ('http://example.com/steady', 500, 0, 400, 100, 0, 50, 90, 1000, 2),
+            ('http://example.com/growing', 100 + hour * 20, 0, 50, 50, 1, 80, 200, 500, 5),
+        ])
+    print history.busiest()
+    for url, before, now in history.movers():
+        print "%s: %.3f/sec -> %.3f/sec" % (url, before, now)
+    print len(history.trend('http://example.com/growing'))
+    history.close()
+    os.unlink(path)
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+hyperloglog.py - Distinct value estimator
+
+See Flajolet, Fusy, Gandouet and Meunier, "HyperLogLog: the analysis of a
+near-optimal cardinality estimation algorithm".
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+import math
+from struct import Struct
+
+_hash64 = Struct('>Q')
+_powers = [2.0 ** -rank for rank in xrange(66)]
+
+
+class HyperLogLog(object):
+    """
+    Estimate how many distinct values have been seen, in a fixed 2 ** precision
+    bytes of memory. The standard error is about 1.04 / sqrt(2 ** precision);
+    e.g., 0.8% for the default precision of 14.
+
+    Values are added as hashes (at least eight bytes long, e.g. an MD5 digest),
+    not as the values themselves.
+
+    The interface is a subset of set's; add() a hash, update() with another
+    HyperLogLog of the same precision, and len() to get the estimate.
+    """
+    __slots__ = ['precision', 'registers']
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, digest):
+        x = _hash64.unpack(digest[:8])[0]
+        bits = 64 - self.precision
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        i = x >> bits
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def update(self, other):
+        if other.precision != self.precision:
+            raise ValueError, "Can't merge HyperLogLogs of different precisions"
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def __len__(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum([_powers[r] for r in self.registers])
+        if estimate <= 2.5 * m:
+            zeros = self.registers.count(b'\x00')
+            if zeros:
+                estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+def test():
+    import hashlib
+    for n in [10, 1000, 100000]:
+        hll = HyperLogLog()
+        for i in xrange(n):
+            hll.add(hashlib.md5(str(i)).digest())
+        print "%7i: %7i" % (n, len(hll))
+
+if __name__ == '__main__':
+    test()
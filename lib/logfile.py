@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+"""
+logfile.py - Log file readers that handle compressed, rotated and growing logs
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+import sys
+import os
+import glob
+import threading
+import zlib
+import bz2
+from Queue import Queue
+
+_magic = [
+    ('\x1f\x8b', 'gzip'),
+    ('BZh', 'bzip2'),
+    ('\xfd7zXZ\x00', 'xz'),
+]
+_magic_len = max([len(m) for m, method in _magic])
+
+
+def compression(head):
+    """
+    Given the first few bytes of a file, return the name of the compression
+    method it uses ('gzip', 'bzip2' or 'xz'), or None if it isn't compressed.
+    """
+    for magic, method in _magic:
+        if head.startswith(magic):
+            return method
+    return None
+
+def expand_paths(args):
+    """
+    Expand any glob patterns in args (e.g., 'access_log.*.gz') that aren't
+    existing files, in sorted order.
+    """
+    paths = []
+    for arg in args:
+        if arg == '-' or os.path.exists(arg):
+            paths.append(arg)
+        else:
+            found = glob.glob(arg)
+            found.sort()
+            paths.extend(found or [arg]) # let open_log complain
+    return paths
+
+def open_log(path, queue_size=16):
+    """
+    Open the log at path ('-' for STDIN) for reading. Uncompressed files
+    are returned as normal file objects; anything else is returned as a
+    DecompressingReader.
+    """
+    if path == '-':
+        head = sys.stdin.read(_magic_len)
+        return DecompressingReader(sys.stdin, compression(head), '<stdin>', 
+                                   queue_size, prefix=head)
+    fd = open(path, 'rb')
+    method = compression(fd.read(_magic_len))
+    fd.seek(0)
+    if method is None:
+        return fd
+    return DecompressingReader(fd, method, path, queue_size)
+
+
+class DecompressingReader(object):
+    """
+    Iterate over the lines (without line endings) of a stream that's
+    compressed with method ('gzip', 'bzip2', 'xz' or None for none).
+
+    Reading and decompressing happens in a background thread, which hands
+    decompressed blocks over through a queue holding at most queue_size of
+    them, so that it can carry on while the lines are being parsed. It
+    starts when iteration does.
+
+    xz needs the lzma module (Python 3.3+, or backports.lzma), or else the
+    xz command.
+    """
+    chunk_size = 256 * 1024
+
+    def __init__(self, fd, method, name, queue_size=16, prefix=''):
+        self._fd = fd
+        self.method = method
+        self.name = name
+        self._prefix = prefix
+        self._queue = Queue(queue_size)
+        self._lines = None
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._lines is None:
+            thread = threading.Thread(target=self._run, name="decompress %s" % self.name)
+            thread.daemon = True
+            thread.start()
+            self._lines = self._read_lines()
+        return self._lines.next()
+
+    def close(self):
+        self._fd.close()
+
+    def _read_lines(self):
+        tail = ''
+        while 1:
+            block = self._queue.get()
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                raise IOError, "%s: %s" % (self.name, block)
+            lines = (tail + block).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line
+        if tail:
+            yield tail
+
+    def _decompressor(self):
+        if self.method == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.method == 'bzip2':
+            return bz2.BZ2Decompressor()
+        if self.method == 'xz':
+            try:
+                import lzma
+            except ImportError:
+                try:
+                    from backports import lzma
+                except ImportError:
+                    return None
+            return lzma.LZMADecompressor()
+        return None
+
+    def _run(self):
+        put = self._queue.put
+        proc = None
+        try:
+            source = self._fd
+            raw = self._prefix
+            decompressor = self._decompressor()
+            if self.method == 'xz' and decompressor is None:
+                from subprocess import Popen, PIPE
+                proc = Popen(['xz', '-dc'], stdin=PIPE, stdout=PIPE)
+                feeder = threading.Thread(target=self._feed, args=(proc.stdin,))
+                feeder.daemon = True
+                feeder.start()
+                source = proc.stdout
+                raw = '' # _feed sends the prefix
+            while 1:
+                if not raw:
+                    raw = source.read(self.chunk_size)
+                    if not raw:
+                        break
+                if decompressor is None:
+                    put(raw)
+                    raw = ''
+                    continue
+                blocks = [decompressor.decompress(raw)]
+                while decompressor.unused_data: # concatenated streams
+                    raw = decompressor.unused_data
+                    decompressor = self._decompressor()
+                    blocks.append(decompressor.decompress(raw))
+                raw = ''
+                block = ''.join(blocks)
+                if block:
+                    put(block)
+            if hasattr(decompressor, 'flush'):
+                block = decompressor.flush()
+                if block:
+                    put(block)
+            if proc is not None:
+                status = proc.wait()
+                proc = None
+                if status:
+                    raise IOError, "xz exited with status %i" % status
+        except Exception, why:
+            put(why)
+        if proc is not None: # stopped early; don't leave a zombie
+            proc.stdout.close()
+            proc.wait()
+        put(None)
+
+    def _feed(self, pipe):
+        try:
+            raw = self._prefix or self._fd.read(self.chunk_size)
+            while raw:
+                pipe.write(raw)
+                raw = self._fd.read(self.chunk_size)
+        finally:
+            pipe.close()
+
+
+class FollowingReader(object):
+    """
+    Read the lines (without line endings) added to the log at path as it
+    grows, like tail -F; when it's rotated (i.e., replaced by a new file) 
+    or truncated, carry on from the start of the new one.
+    """
+    chunk_size = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._tail = ''
+        self._open()
+
+    def _open(self):
+        try:
+            self._fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            self._fd = None # not there (yet)
+
+    def read_lines(self):
+        """
+        Return a list of the complete lines added since the last call; it's 
+        empty if there aren't any.
+        """
+        if self._fd is None:
+            self._open()
+            if self._fd is None:
+                return []
+        raw = os.read(self._fd, self.chunk_size)
+        if not raw:
+            if not self._replaced():
+                return []
+            os.close(self._fd)
+            self._open()
+            lines = [self._tail] # the old file ended without a newline
+            self._tail = ''
+            return filter(None, lines)
+        lines = (self._tail + raw).split('\n')
+        self._tail = lines.pop()
+        return lines
+
+    def _replaced(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False # moved away, but not replaced yet
+        ours = os.fstat(self._fd)
+        return (st.st_dev, st.st_ino) != (ours.st_dev, ours.st_ino) \
+          or st.st_size < os.lseek(self._fd, 0, os.SEEK_CUR)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
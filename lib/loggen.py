@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+loggen.py - Synthetic Squid access log generator
+
+Generates native-format Squid access log lines with a given number of URLs,
+whose popularity follows a Zipf distribution, along with a mix of log tags,
+query strings and (optionally) Link headers as extra fields; e.g., for 
+benchmarking.
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+import bisect
+import random
+import sys
+import urllib
+
+# log tag/status -> relative frequency
+default_tags = {
+    'TCP_HIT/200': 20,
+    'TCP_MEM_HIT/200': 25,
+    'TCP_MISS/200': 25,
+    'TCP_REFRESH_HIT/304': 8,
+    'TCP_REFRESH_MISS/200': 3,
+    'TCP_CLIENT_REFRESH_MISS/200': 3,
+    'TCP_IMS_HIT/304': 5,
+    'TCP_STALE_HIT/200': 2,
+    'TCP_NEGATIVE_HIT/404': 2,
+    'TCP_MISS/404': 2,
+    'TCP_MISS/503': 1,
+    'TCP_DENIED/403': 1,
+    'TCP_ASYNC_MISS/200': 1,
+    'UDP_HIT/000': 2,
+}
+
+
+class _Chooser(object):
+    "Choose items with probabilities proportional to their weights."
+    def __init__(self, items, weights, rand):
+        self.items = items
+        self.cumulative = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+        self.total = total
+        self.rand = rand
+
+    def __call__(self):
+        return self.items[bisect.bisect(self.cumulative, self.rand() * self.total)]
+
+
+def generate(num_lines, num_urls=10000, skew=1.0, tags=None, 
+             query_fraction=0.3, num_queries=1000, link_fraction=0.0,
+             start=1380000000.0, rate=100.0, error_fraction=0.0, seed=0):
+    """
+    Yield num_lines log lines (without line endings).
+
+    num_urls: number of distinct URLs (before queries are added)
+    skew: Zipf exponent for URL (and query) popularity; 0 is uniform
+    tags: dict of 'LOG_TAG/status' -> relative frequency
+    query_fraction: fraction of requests that have a query string
+    num_queries: number of distinct query strings per URL, at most
+    link_fraction: fraction of requests with a Link header as an extra field
+    start: time of the first request, in seconds since the epoch
+    rate: average requests per second
+    error_fraction: fraction of lines that are garbled
+    seed: random seed, so that runs are reproducible
+    """
+    rand = random.Random(seed)
+    tags = tags or default_tags
+    tag_names = tags.keys()
+    tag_names.sort()
+    choose_tag = _Chooser(tag_names, [tags[t] for t in tag_names], rand.random)
+    ranks = range(1, num_urls + 1)
+    choose_url = _Chooser(ranks, [1.0 / r ** skew for r in ranks], rand.random)
+    query_ranks = range(1, max(num_queries, 1) + 1)
+    choose_query = _Chooser(query_ranks, [1.0 / r ** skew for r in query_ranks], 
+                            rand.random)
+    now = start
+    for i in xrange(num_lines):
+        now += rand.expovariate(rate)
+        if error_fraction and rand.random() < error_fraction:
+            yield "%.3f garbled line" % now
+            continue
+        rank = choose_url()
+        url = "http://www%i.example.com/%s/%i.html" % (rank % 7, "abcdefgh"[rank % 8], rank)
+        if query_fraction and rand.random() < query_fraction:
+            url += "?q=%i" % choose_query()
+        tag = choose_tag()
+        if tag[-4:] == '/304' or tag[-4:] == '/000':
+            size = rand.randint(150, 300)
+        else:
+            size = int(rand.lognormvariate(9, 1.5))
+        if 'HIT' in tag:
+            elapsed = int(rand.expovariate(1 / 2.0))
+            peer = "NONE/-"
+        else:
+            elapsed = int(rand.lognormvariate(4.5, 1))
+            peer = "DIRECT/192.0.2.%i" % (rank % 250 + 1)
+        line = "%.3f %6i 10.%i.%i.%i %s %i GET %s - %s text/html" % (
+            now, elapsed, rank % 3, rand.randint(0, 255), rand.randint(1, 254),
+            tag, size, url, peer)
+        if link_fraction and rand.random() < link_fraction:
+            line += " " + urllib.quote('<http://example.com/canonical/%i>; rel="canonical"' % rank)
+        yield line
+
+
+def test():
+    import getopt
+    opts, args = getopt.getopt(sys.argv[1:], "n:u:s:q:l:e:r:", ["seed="])
+    opts = dict(opts)
+    for line in generate(int(opts.get('-n', 1000)), 
+                         num_urls=int(opts.get('-u', 10000)),
+                         skew=float(opts.get('-s', 1.0)),
+                         query_fraction=float(opts.get('-q', 0.3)),
+                         link_fraction=float(opts.get('-l', 0.0)),
+                         error_fraction=float(opts.get('-e', 0.0)),
+                         rate=float(opts.get('-r', 100.0)),
+                         seed=int(opts.get('--seed', 0))):
+        print line
+
+if __name__ == '__main__':
+    test()
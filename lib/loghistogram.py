@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""
+loghistogram.py - Log-linear histogram
+
+Along the lines of Gil Tene's HdrHistogram; <http://hdrhistogram.org/>.
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+from array import array
+
+
+class LogHistogram(object):
+    """
+    A histogram of non-negative integers (e.g., milliseconds or bytes) with
+    a fixed relative error and an unbounded range.
+
+    Values below 2 ** sub_bits are counted exactly; above that, each power
+    of two is split into 2 ** (sub_bits - 1) buckets, so that values are
+    reported to within 2 ** -sub_bits (about 1.6% by default) of what was
+    seen. Counts are kept in an array that grows to the largest bucket
+    seen; e.g., a minute in milliseconds takes about 400 buckets.
+
+    Values are appended in their raw integer form, and reported (by
+    percentile(), min_seen, max_seen, sum_seen, etc.) divided by unit; e.g., use
+    unit=1024 to append bytes and report kilobytes.
+
+    Histograms with the same sub_bits can be merged.
+    """
+    __slots__ = ['sub_bits', 'unit', 'counts', 'total', '_sum', '_min', '_max', 'median', 'max_value']
+
+    def __init__(self, unit=1, sub_bits=6):
+        self.sub_bits = sub_bits
+        self.unit = unit
+        self.counts = array('L')
+        self.total = 0
+        self._sum = 0
+        self._min = None
+        self._max = None
+        self.median = None
+        self.max_value = None
+
+    def __getstate__(self):
+        return (self.sub_bits, self.unit, self.counts.tostring(), self.total, 
+                self._sum, self._min, self._max)
+
+    def __setstate__(self, state):
+        self.sub_bits, self.unit, counts, self.total, self._sum, self._min, self._max = state
+        self.counts = array('L')
+        self.counts.fromstring(counts)
+        self.median = None
+        self.max_value = None
+
+    def index(self, value):
+        "Return the index of the bucket that the raw value is counted in."
+        if value < (1 << self.sub_bits):
+            return max(value, 0)
+        shift = value.bit_length() - self.sub_bits
+        return (shift << (self.sub_bits - 1)) + (value >> shift)
+
+    def bounds(self, index):
+        "Return the lowest raw value in the bucket at index, and its width."
+        if index < (1 << self.sub_bits):
+            return index, 1
+        shift = (index >> (self.sub_bits - 1)) - 1
+        return (index - (shift << (self.sub_bits - 1))) << shift, 1 << shift
+
+    def append(self, value):
+        value = int(value)
+        if self._min is None or value < self._min: self._min = value
+        if self._max is None or value > self._max: self._max = value
+        i = self.index(value)
+        counts = self.counts
+        if i >= len(counts):
+            counts.extend(array('L', [0]) * (i + 1 - len(counts)))
+        counts[i] += 1
+        self.total += 1
+        self._sum += value
+
+    def merge(self, other):
+        "Add the data from another LogHistogram with the same sub_bits to this one."
+        if other.sub_bits != self.sub_bits:
+            raise ValueError, "Can't merge LogHistograms with different sub_bits"
+        if other._min is not None and (self._min is None or other._min < self._min):
+            self._min = other._min
+        if other._max is not None and (self._max is None or other._max > self._max):
+            self._max = other._max
+        counts = self.counts
+        if len(other.counts) > len(counts):
+            counts.extend(array('L', [0]) * (len(other.counts) - len(counts)))
+        for i, count in enumerate(other.counts):
+            if count:
+                counts[i] += count
+        self.total += other.total
+        self._sum += other._sum
+
+    def _scaled(self, value):
+        if value is None:
+            return None
+        if self.unit == 1:
+            return value
+        return value / float(self.unit)
+
+    @property
+    def min_seen(self):
+        return self._scaled(self._min)
+
+    @property
+    def max_seen(self):
+        return self._scaled(self._max)
+
+    @property
+    def sum_seen(self):
+        "The sum of the values seen (exactly, not from the buckets)."
+        return self._scaled(self._sum)
+
+    def percentile(self, fraction):
+        """
+        Return the value that fraction (e.g., .5 for the median) of the data
+        is at or below, or None if there's no data.
+        """
+        return self.percentiles([fraction])[0]
+
+    def percentiles(self, fractions):
+        "Return a list of percentile()s for each of fractions, in one pass."
+        if not self.total:
+            return [None] * len(fractions)
+        ranks = [min(int(self.total * f), self.total - 1) for f in fractions]
+        results = [None] * len(fractions)
+        todo = range(len(ranks))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if not count:
+                continue
+            seen += count
+            for j in todo[:]:
+                if ranks[j] < seen:
+                    low, width = self.bounds(i)
+                    value = low + (width - 1) / 2 # middle of the bucket
+                    results[j] = self._scaled(min(max(value, self._min), self._max))
+                    todo.remove(j)
+            if not todo:
+                break
+        return results
+
+    def img(self, finish, width=80, height=20, color=(32,32,32,255), 
+            bg_color=(255,255,255,0), median_color=(0,0,255,255)):
+        """
+        Return a data: URI for a sparkline of the data from zero to finish
+        (in reporting units) with the median highlighted; anything over
+        finish is shown as a red line at the right edge. Returns an empty
+        string if there's no data.
+        """
+        from squidpeek_lib.sparkogram import draw_histogram
+        self.median = self.percentile(.5)
+        if self.median is None:
+            return ""
+        num_columns = width - 2
+        column_width = finish * self.unit / float(num_columns)
+        columns = [0] * num_columns
+        over = 0
+        for i, count in enumerate(self.counts):
+            if not count:
+                continue
+            low, bucket_width = self.bounds(i)
+            first = int(low / column_width)
+            last = int((low + bucket_width - 1) / column_width)
+            if first >= num_columns:
+                over += count
+                continue
+            last = min(last, num_columns - 1)
+            share = count / float(last - first + 1) # spread wide buckets out
+            for column in xrange(first, last + 1):
+                columns[column] += share
+        median_x = int(self.median * self.unit / column_width)
+        if median_x >= num_columns:
+            median_x = None
+        self.max_value = float(max(columns + [over]))
+        return draw_histogram(columns, self.max_value, 0, over, median_x,
+                              width, height, color, bg_color, median_color)
+
+
+def test():
+    import random
+    h = LogHistogram()
+    data = [int(random.lognormvariate(5, 1.5)) for i in xrange(10000)]
+    for value in data:
+        h.append(value)
+    data.sort()
+    for f in [0, .5, .9, .99]:
+        print "%3i%%: %8s actual: %i" % (f * 100, h.percentile(f), data[int(len(data) * f)])
+    print h.img(1000)
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+lrucache.py - Bounded cache of recently used values
+
+Keeps two generations of entries; when the newer one fills up, the older one
+is dropped and the newer one takes its place. Entries that are looked up
+again are moved into the newer generation, so what's dropped is
+(approximately) what was least recently used, without the bookkeeping of an
+exact LRU list.
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+
+class LRUCache(object):
+    """
+    Map keys to values, remembering between capacity and 2 * capacity of the
+    most recently used ones.
+    """
+    __slots__ = ['capacity', 'misses', '_new', '_old']
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.misses = 0
+        self._new = {}
+        self._old = {}
+
+    def get(self, key):
+        "Return the value for key, or None if it isn't cached."
+        try:
+            return self._new[key]
+        except KeyError:
+            pass
+        value = self._old.pop(key, None)
+        if value is None:
+            self.misses += 1
+        else:
+            self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        "Cache value for key."
+        if len(self._new) >= self.capacity:
+            self._old = self._new
+            self._new = {}
+        self._new[key] = value
+
+    def clear(self):
+        self._new.clear()
+        self._old.clear()
+
+    def __len__(self):
+        return len(self._new) + len(self._old)
+
+
+def test():
+    import random
+    cache = LRUCache(100)
+    lookups = 100000
+    for i in xrange(lookups):
+        key = int(random.paretovariate(0.8))
+        if cache.get(key) is None:
+            cache.set(key, str(key))
+    print "%i entries, %i misses in %i lookups" % (len(cache), cache.misses, lookups)
+
+if __name__ == '__main__':
+    test()
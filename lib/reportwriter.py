@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+reportwriter.py - Buffered, atomic output for reports
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+import os
+import sys
+
+
+class ReportWriter(object):
+    """
+    Write a report to fh (default: STDOUT), or to the file at path, in
+    blocks of about buffer_size bytes.
+
+    When writing to path, the report goes to a temporary file next to it,
+    which only replaces path when close() is called; if abort() is called 
+    instead (e.g., because of an error), path is left untouched.
+    """
+    def __init__(self, path=None, fh=None, buffer_size=256 * 1024):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+        if path is not None:
+            self._tmp_path = "%s.tmp%s" % (path, os.getpid())
+            self._fh = open(self._tmp_path, 'w')
+        else:
+            self._tmp_path = None
+            self._fh = fh or sys.stdout
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def writelines(self, texts):
+        for text in texts:
+            self.write(text)
+
+    def flush(self):
+        "Write out what's buffered."
+        self._fh.write("".join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+        self._fh.flush()
+
+    def close(self):
+        "Finish the report, replacing path with it if there is one."
+        self.flush()
+        if self._tmp_path is not None:
+            os.fsync(self._fh.fileno())
+            self._fh.close()
+            os.rename(self._tmp_path, self.path)
+            self._tmp_path = None
+
+    def abort(self):
+        "Throw away the report, if it's going to path."
+        self._buffer = []
+        self._buffered = 0
+        if self._tmp_path is not None:
+            self._fh.close()
+            try:
+                os.unlink(self._tmp_path)
+            except OSError:
+                pass
+            self._tmp_path = None
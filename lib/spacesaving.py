@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+
+"""
+spacesaving.py - Streaming top-k counter
+
+An implementation of the Space-Saving algorithm; see Metwally, Agrawal and
+El Abbadi, "Efficient Computation of Frequent and Top-k Elements in Data
+Streams". Merging follows Agarwal et al, "Mergeable Summaries".
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+
+class SpaceSaving(object):
+    """
+    Count the occurrences of at most capacity keys in a stream, keeping the
+    ones most likely to be the most frequent. Each key can also carry a
+    value (e.g., more detailed statistics about it).
+
+    When a new key arrives and there's no room, the key with the lowest count
+    is evicted, and the new one inherits its count. Therefore, count(key)
+    never underestimates how many times key was seen, and overestimates it
+    by at most error(key); the value only reflects the last
+    count(key) - error(key) occurrences.
+
+    Counting a key takes O(1) time, amortised.
+    """
+    __slots__ = ['capacity', 'counts', 'errors', 'values', 'evictions', 
+                 '_buckets', '_min', '_evicted']
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.values = {}
+        self.evictions = 0 # how many keys have been dropped to make room
+        self._buckets = {} # count -> {key: None}
+        self._min = None
+        self._evicted = 0 # the highest count that a dropped key had
+
+    @classmethod
+    def from_counts(cls, capacity, counts, errors, values=None, floor=0):
+        """
+        Make a SpaceSaving that has counted the keys in counts (a dict of
+        key -> count), with errors and values (dicts keyed the same way),
+        and that dropped keys seen up to floor times.
+        """
+        ss = cls(capacity)
+        ss.counts = counts
+        ss.errors = errors
+        ss._evicted = floor
+        if values is not None:
+            ss.values = values
+        for key, count in counts.iteritems():
+            ss._bucket(key, count)
+        if ss._buckets:
+            ss._min = min(ss._buckets)
+        return ss
+
+    def add(self, key, weight=1):
+        """
+        Count key weight times. Return its value, or None if it wasn't
+        being tracked (in which case, set one with ss[key] = value).
+        """
+        counts = self.counts
+        if key in counts:
+            count = counts[key]
+            counts[key] = count + weight
+            self._bucket(key, count + weight)
+            self._unbucket(key, count)
+            return self.values.get(key)
+        if len(counts) < self.capacity:
+            floor = self._evicted
+            counts[key] = floor + weight
+            self.errors[key] = floor
+            self._bucket(key, floor + weight)
+            if self._min is None or floor + weight < self._min:
+                self._min = floor + weight
+            return None
+        low = self._min
+        victim = self._buckets[low].popitem()[0]
+        self.evictions += 1
+        if low > self._evicted:
+            self._evicted = low
+        del counts[victim], self.errors[victim]
+        self.values.pop(victim, None)
+        # key could have been seen as many times as anything dropped
+        floor = self._evicted
+        counts[key] = floor + weight
+        self.errors[key] = floor
+        self._bucket(key, floor + weight)
+        if not self._buckets[low]:
+            del self._buckets[low]
+            self._next_min(low)
+        return None
+
+    def _bucket(self, key, count):
+        try:
+            self._buckets[count][key] = None
+        except KeyError:
+            self._buckets[count] = {key: None}
+
+    def _unbucket(self, key, count):
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if count == self._min:
+                self._next_min(count)
+
+    def _next_min(self, count):
+        if count + 1 in self._buckets: # the common case, when counting by one
+            self._min = count + 1
+        else:
+            self._min = min(self._buckets)
+
+    def cap(self, key, count):
+        """
+        Lower key's count to count, if that is known (e.g., from a
+        CountMinSketch) to be an upper bound on how many times it was seen.
+        """
+        old = self.counts[key]
+        if count >= old:
+            return
+        self.counts[key] = count
+        self.errors[key] = max(self.errors[key] - (old - count), 0)
+        self._bucket(key, count)
+        self._unbucket(key, old)
+        if count < self._min:
+            self._min = count
+
+    def count(self, key):
+        "Return the (over)estimated number of times key has been seen."
+        return self.counts[key]
+
+    def error(self, key):
+        "Return the most that count(key) could be overestimating by."
+        return self.errors[key]
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        if key not in self.counts:
+            raise KeyError, key
+        self.values[key] = value
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def keys(self):
+        return self.counts.keys()
+
+    def floor(self):
+        """
+        Return the count that any key not being tracked could have been
+        seen up to. That's usually the lowest count, but cap() can take
+        counts below what a dropped key had.
+        """
+        if len(self.counts) < self.capacity:
+            return self._evicted
+        return max(self._min, self._evicted)
+
+    def merge(self, other, merge_value=None, copy_value=None):
+        """
+        Add the counts from another SpaceSaving to this one, keeping the
+        capacity most frequent keys. When a key has a value in both,
+        merge_value(ours, theirs) is called to fold theirs into ours; values
+        only other has are taken over, or copied with copy_value(theirs) if
+        it's given, so that other can be used again.
+        """
+        our_floor, their_floor = self.floor(), other.floor()
+        self._evicted = our_floor + their_floor
+        counts = {}
+        errors = {}
+        for key in self.counts:
+            counts[key] = self.counts[key] + other.counts.get(key, their_floor)
+            errors[key] = self.errors[key] + other.errors.get(key, their_floor)
+        for key in other.counts:
+            if key not in self.counts:
+                counts[key] = other.counts[key] + our_floor
+                errors[key] = other.errors[key] + our_floor
+        keep = counts.keys()
+        self.evictions += other.evictions + max(0, len(keep) - self.capacity)
+        if len(keep) > self.capacity:
+            keep.sort(key=counts.get, reverse=True)
+            keep = keep[:self.capacity]
+        values = {}
+        for key in keep:
+            if key in self.values:
+                values[key] = self.values[key]
+                if key in other.values and merge_value is not None:
+                    merge_value(values[key], other.values[key])
+            elif key in other.values:
+                if copy_value is None:
+                    values[key] = other.values[key]
+                else:
+                    values[key] = copy_value(other.values[key])
+        self.counts = {}
+        self.errors = {}
+        self.values = values
+        self._buckets = {}
+        for key in keep:
+            self.counts[key] = counts[key]
+            self.errors[key] = errors[key]
+            self._bucket(key, counts[key])
+        if self._buckets:
+            self._min = min(self._buckets)
+        else:
+            self._min = None
+
+
+def test():
+    import random
+    ss = SpaceSaving(10)
+    seen = {}
+    for i in xrange(10000):
+        key = int(random.paretovariate(1))
+        seen[key] = seen.get(key, 0) + 1
+        ss.add(key)
+    keys = ss.keys()
+    keys.sort(key=ss.count, reverse=True)
+    for key in keys:
+        print "%6s %6i (+%i) actual: %i" % (
+            key, ss.count(key), ss.error(key), seen[key])
+
+    # many distinct keys (Zipf 0.8 over 6000 of them), with new ones capped
+    # by a CountMinSketch, as squidpeek counts queries
+    import bisect
+    import hashlib
+    from countmin import CountMinSketch
+    cumulative = []
+    total = 0.0
+    for rank in xrange(1, 6001):
+        total += rank ** -0.8
+        cumulative.append(total)
+    ss = SpaceSaving(256)
+    cms = CountMinSketch(1024, 2)
+    seen = {}
+    for i in xrange(100000):
+        key = hashlib.md5(str(bisect.bisect(cumulative, random.random() * total))).digest()
+        seen[key] = seen.get(key, 0) + 1
+        cms.add(key)
+        new = key not in ss.counts
+        ss.add(key)
+        if new:
+            ss.cap(key, cms.estimate(key))
+    dropped = max([count for key, count in seen.items() if key not in ss.counts])
+    under = [key for key in ss.keys() if ss.count(key) < seen[key]]
+    print "floor: %i, most seen of the dropped keys: %i, undercounted: %i" % (
+        ss.floor(), dropped, len(under))
+    assert dropped <= ss.floor() and not under
+    actual = seen.values()
+    actual.sort(reverse=True)
+    estimated = []
+    for key in ss.keys():
+        low = ss.count(key) - ss.error(key)
+        if low > ss.floor():
+            high = min(ss.count(key), cms.estimate(key))
+            estimated.append(max(low, min(high, cms.estimate_mean(key))))
+    estimated.sort(reverse=True)
+    for i in [0, 9, 99]:
+        if i < len(estimated):
+            print "top %3i: %5.1f%% of counts, actual: %5.1f%%" % (i + 1, 
+                sum(estimated[:i + 1]) * 100.0 / cms.total(), sum(actual[:i + 1]) * 100.0 / 100000)
+
+if __name__ == '__main__':
+    test()
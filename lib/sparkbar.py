@@ -28,10 +28,7 @@ SOFTWARE.
 
 __version__ = '0.3'
 
-import sys
-import base64
-import StringIO
-from PIL import Image, ImageDraw # <http://www.pythonware.com/products/pil/>
+from squidpeek_lib.canvas import new_canvas
 
 class Sparkbar(object):
     """
@@ -52,9 +49,8 @@ class Sparkbar(object):
     bg_color: background color
     median_color: color that median value will be highlighted with
     
-    Note that colors can be specified in a variety of ways, depending on
-    the version of PIL that you have installed. See:
-      <http://www.pythonware.com/library/pil/handbook/imagedraw.htm>
+    Colors are (red, green, blue[, alpha]) tuples; the image is drawn with
+    the backend selected in squidpeek_lib.canvas.
     """
     __slots__ = ['data']
 
@@ -64,28 +60,34 @@ class Sparkbar(object):
     def append(self, num, title, color):
         self.data.append((num, title, color))
 
-    def img(self, width=80, height=20, bg_color=(255,255,255,0)):
+    def image(self, width=80, height=20, bg_color=(255,255,255,0)):
+        """
+        Draw the bar, and return its (data: URI, title, width, height).
+        """
         total = float(sum([item[0] for item in self.data]))
         
         data = [(int(i[0] / total * width), i[1], i[2]) for i in self.data]
 
-        im = Image.new("RGBA", (width, height + 1), bg_color)
-        draw = ImageDraw.Draw(im)
+        canvas = new_canvas(width, height + 1, bg_color)
         left_buf = 0
         for item in data:
-            draw.rectangle([(left_buf, 0), (left_buf + item[0], height)], fill=item[2])
+            canvas.fill(left_buf, 0, left_buf + item[0], height, item[2])
             left_buf += item[0]
-        del draw
 
-        f = StringIO.StringIO()
-        im.save(f, "PNG")
+        title = "\n".join(["%s: %i" % (i[1], i[0]) for i in self.data])
+        return canvas.data_uri(), title, width, height + 1
+
+    def img(self, width=80, height=20, bg_color=(255,255,255,0), sheet=None):
+        """
+        Return an IMG tag for the bar; if sheet (a canvas.ImageSheet) is 
+        given, the image is added to it and an element referring to it is 
+        returned instead.
+        """
+        uri, title, width, height = self.image(width, height, bg_color)
+        if sheet is not None:
+            return sheet.img(uri, title, width, height)
         return """\
-<img src="data:image/png;base64,%s" title="%s"/>""" % (
-          base64.encodestring(f.getvalue()).replace('\n', ''), 
-          "\n".join(["%s: %i" % (i[1], i[0]) for i in self.data])
-          )
-        del f
-        del im
+<img src="%s" title="%s"/>""" % (uri, title)
 
 def test():
     sp = Sparkbar()
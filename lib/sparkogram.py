@@ -31,10 +31,7 @@ SOFTWARE.
 
 __version__ = '0.23'
 
-import sys
-import base64
-import StringIO
-from PIL import Image, ImageDraw # <http://www.pythonware.com/products/pil/>
+from squidpeek_lib.canvas import new_canvas
 
 class Sparkogram(object):
     """
@@ -55,9 +52,8 @@ class Sparkogram(object):
     bg_color: background color
     median_color: color that median value will be highlighted with
     
-    Note that colors can be specified in a variety of ways, depending on
-    the version of PIL that you have installed. See:
-      <http://www.pythonware.com/library/pil/handbook/imagedraw.htm>
+    Colors are (red, green, blue[, alpha]) tuples; the image is drawn with
+    the backend selected in squidpeek_lib.canvas.
     """
     __slots__ = ['min', 'max', 'num_buckets', 'bucket_width', 'buckets', '_over', '_under', 'min_seen', 'max_seen', 'median', 'max_value']
 
@@ -79,27 +75,74 @@ class Sparkogram(object):
         self.median = None
         self.max_value = None
 
-    def append(self, data):
+    def append(self, data, count=1):
+        "Add data, count times."
         if self.min_seen is None or data < self.min_seen: self.min_seen = data
         if self.max_seen is None or data > self.max_seen: self.max_seen = data
         if data > self.max:
-            self._over += 1
+            self._over += count
             return
         if data < self.min:
-            self._under += 1
+            self._under += count
             return
         i = data - self.min
         try:
-            self.buckets[i - (i % self.bucket_width)] += 1
+            self.buckets[i - (i % self.bucket_width)] += count
         except KeyError:
-            self.buckets[i - (i % self.bucket_width)] = 1
+            self.buckets[i - (i % self.bucket_width)] = count
+
+    def merge(self, other):
+        """
+        Add the data from another Sparkogram with the same min, max and
+        num_buckets to this one.
+        """
+        if other.min_seen is not None and \
+          (self.min_seen is None or other.min_seen < self.min_seen):
+            self.min_seen = other.min_seen
+        if other.max_seen is not None and \
+          (self.max_seen is None or other.max_seen > self.max_seen):
+            self.max_seen = other.max_seen
+        self._over += other._over
+        self._under += other._under
+        for bucket, count in other.buckets.iteritems():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def percentile(self, fraction):
+        """
+        Return the value that fraction (e.g., .5 for the median) of the data
+        is at or below, to the nearest bucket; values below min or above max
+        count as min and max respectively. Returns None if there's no data.
+        """
+        return self.percentiles([fraction])[0]
+
+    def percentiles(self, fractions):
+        "Return a list of percentile()s for each of fractions, in one pass."
+        total = sum(self.buckets.itervalues()) + self._under + self._over
+        if total == 0:
+            return [None] * len(fractions)
+        ranks = [min(int(total * f), total - 1) for f in fractions]
+        results = [self.max] * len(fractions)
+        seen = self._under
+        todo = [i for i in xrange(len(ranks)) if ranks[i] >= seen]
+        for i in xrange(len(ranks)):
+            if ranks[i] < seen:
+                results[i] = self.min
+        bl = self.buckets.keys()
+        bl.sort()
+        for b in bl:
+            if not todo:
+                break
+            seen += self.buckets[b]
+            for i in todo[:]:
+                if ranks[i] < seen:
+                    results[i] = b + self.min
+                    todo.remove(i)
+        return results
 
     def img(self, width=80, height=20, color=(32,32,32,255), 
             bg_color=(255,255,255,0), median_color=(0,0,255,255)):
         bl = self.buckets.keys()
         bl.sort()
-        dataset = []
-        [dataset.extend([b] * self.buckets[b]) for b in bl if self.buckets[b]]
 
         # figure out the image buckets
         num_img_buckets = width - 2
@@ -107,48 +150,53 @@ class Sparkogram(object):
         if img_bucket_width == 0: # hack for single-value datasets
             img_bucket_width = 1.0
         img_buckets = dict([(n * img_bucket_width, 0) for n in xrange(num_img_buckets + 1)])
-        for item in dataset:
+        for b in bl:
             try:
-                img_buckets[item - (item % img_bucket_width)] += 1
+                img_buckets[b - (b % img_bucket_width)] += self.buckets[b]
             except KeyError:
                 k = img_buckets.keys()
                 k.sort()
-                print item, img_bucket_width, k
+                print b, img_bucket_width, k
                 raise KeyError
         img_bl = img_buckets.keys()
         img_bl.sort()
 
         # calculate median
-        dataset.extend([self.min] * self._under)
-        dataset.extend([self.max] * self._over)
-        dataset.sort()
-        if len(dataset) == 0: return ""
-        median = dataset[int(len(dataset) / 2)]
+        self.median = self.percentile(.5)
+        if self.median is None: return ""
+        median = self.median - self.min
         try:
             median_x = img_bl.index((median) - ((median) % img_bucket_width))
         except ValueError: # median is in the min or max
             median_x = None
         self.max_value = float(max(img_buckets.values() + [self._over, self._under]))
-        self.median = median + self.min
-
-        height -= 1
-        coords = [(i + 1, height - (height * (img_buckets[img_bl[i]] / self.max_value)))
-                  for i in xrange(num_img_buckets)]
-        im = Image.new("RGBA", (width, height + 1), bg_color)
-        draw = ImageDraw.Draw(im)
-        if self._under > 0:
-            draw.line([(0, height), (0, height - (height * max(self._under / self.max_value), 1))], fill=(255,0,0,255))
-        for x, y in coords:
-            if y != height:
-                this_color = (x == median_x) and median_color or color
-                draw.line([(x, height), (x, y)], fill=this_color)
-        if self._over > 0:
-            draw.line([(width - 1, height), (width -1, height - (height * max(self._over / self.max_value, 1)))], fill=(255,0,0,255))
-        del draw
-
-        f = StringIO.StringIO()
-        im.save(f, "PNG")
-        return "data:image/png;base64,%s" % base64.encodestring(f.getvalue()).replace('\n', '')
+
+        return draw_histogram([img_buckets[b] for b in img_bl[:num_img_buckets]],
+                              self.max_value, self._under, self._over, median_x,
+                              width, height, color, bg_color, median_color)
+
+def draw_histogram(columns, max_value, under=0, over=0, highlight=None, 
+                   width=80, height=20, color=(32,32,32,255), 
+                   bg_color=(255,255,255,0), median_color=(0,0,255,255)):
+    """
+    Draw a histogram sparkline with width - 2 columns, scaled so that max_value
+    is full height, and return it as a data: URI. If there are under or over
+    values, red lines are drawn at the left and right edges respectively;
+    the column before highlight (if any) is drawn in median_color.
+    """
+    height -= 1
+    coords = [(i + 1, height - (height * (columns[i] / max_value)))
+              for i in xrange(len(columns))]
+    canvas = new_canvas(width, height + 1, bg_color)
+    if under > 0:
+        canvas.fill(0, int(height - (height * max(under / max_value, 1))), 0, height, (255,0,0,255))
+    for x, y in coords:
+        if y != height:
+            this_color = (x == highlight) and median_color or color
+            canvas.fill(x, int(y), x, height, this_color)
+    if over > 0:
+        canvas.fill(width - 1, int(height - (height * max(over / max_value, 1))), width - 1, height, (255,0,0,255))
+    return canvas.data_uri()
 
 def test():
     sp = Sparkogram(0, 1000)
@@ -44,9 +44,11 @@ __version__ = '2.0'
 
 
 from string import atoi, atof, split, join, lower
-from re import compile
+from re import compile, escape
+from itertools import ifilterfalse
 from urllib import unquote
 import sys
+import os
 
 
 class AccessParser:
@@ -57,12 +59,17 @@ class AccessParser:
     _mime_hasher = compile("([\w\-_]+):\s*(.*)$")
     _time_headers = ['date', 'last-modified', 'expires']
 
-    def __init__(self, file_descriptor, parse_headers=False, debug=False):
+    def __init__(self, file_descriptor, parse_headers=False, debug=False, skip=None):
         self._fd = file_descriptor
         self.parse_headers = parse_headers
         self.debug = debug
+        self.skip = skip # regex of raw lines not to parse; see line_filter()
+        if skip is not None: # the lines it matches that are safe to drop unparsed
+            self._skip_clean = compile('(?=%s)%s' % (skip.pattern, _well_formed.pattern), skip.flags)
         self.num_processed = 0
         self.num_error = 0
+        self.num_skipped = 0
+        self.errors = {} # cause -> count
 
     def __iter__(self):
         return self
@@ -71,38 +78,76 @@ class AccessParser:
         while 1:     # loop until we find a valid line, or end
             line = self._fd.next()
             self.num_processed += 1
-            n = split(line, None)
+            if self.skip is not None and self._skippable(line):
+                self.num_skipped += 1
+                continue
             try:
-                o = {
-                    'utime': int(float(n[0])),
-                    'elapsed': int(n[1]),
-                    'client': n[2],
-                    'bytes': int(n[4]),
-                    'method': n[5],
-                    'url': n[6],
-                    'ident': n[7],
-                    'mimetype': n[9]
-                }
-                o['log_tag'], status = split(n[3], '/', 2) 
-                o['status'] = int(status)
-                o['peer_tag'], o['peerhost'] = split(n[8], '/', 2)
-                if len(n) > 10: 
-                    if self.parse_headers and n[10][0] == '[':  # mime headers present                
-                        o['hdr_request'], o['hdr_response'] = self._parse_mime(" ".join(n[10:]))
-                    else: # some other fields; just save them raw in extra...
-                        i = 0
-                        for field in n[10:]:
-                            i += 1
-                            o['extra_%s' % i] = field
-                return o
+                return self._parse(line)
             except Exception, why:
-                self.num_error = self.num_error + 1
-                if self.debug:
-                    sys.stderr.write("PARSE ERROR line %s: %s\n" % (
-                        self.num_processed, why
-                    ))
+                self._error(why)
                 continue        
 
+    def _parse(self, line):
+        "Return the fields of a raw line as a dict; raises if it's broken."
+        n = split(line, None)
+        o = {
+            'utime': int(float(n[0])),
+            'elapsed': int(n[1]),
+            'client': n[2],
+            'bytes': int(n[4]),
+            'method': n[5],
+            'url': n[6],
+            'ident': n[7],
+            'mimetype': n[9]
+        }
+        o['log_tag'], status = split(n[3], '/', 2) 
+        o['status'] = int(status)
+        o['peer_tag'], o['peerhost'] = split(n[8], '/', 2)
+        if len(n) > 10: 
+            if self.parse_headers and n[10][0] == '[':  # mime headers present                
+                o['hdr_request'], o['hdr_response'] = self._parse_mime(" ".join(n[10:]))
+            else: # some other fields; just save them raw in extra...
+                i = 0
+                for field in n[10:]:
+                    i += 1
+                    o['extra_%s' % i] = field
+        return o
+
+    def _skippable(self, line):
+        '''
+        Return whether the raw line can be dropped without counting it:
+        self.skip matches it, and it isn't broken (so that those are still
+        counted as errors). Lines that aren't plainly well-formed are parsed
+        to find out.
+        '''
+        if not self.skip.match(line):
+            return False
+        if _well_formed.match(line):
+            return True
+        try:
+            self._parse(line)
+        except Exception:
+            return False
+        return True
+
+    def _drop_skippable(self, lines):
+        "Return the list of lines without the _skippable() ones, counting them."
+        kept = list(ifilterfalse(self._skip_clean.match, lines))
+        if filter(self.skip.match, kept): # rarely; these have to be parsed to tell
+            kept = list(ifilterfalse(self._skippable, kept))
+        self.num_skipped += len(lines) - len(kept)
+        return kept
+
+    def _error(self, why):
+        "Count a parse error on the current line, because of why."
+        self.num_error = self.num_error + 1
+        cause = _error_causes.get(why.__class__, why.__class__.__name__)
+        self.errors[cause] = self.errors.get(cause, 0) + 1
+        if self.debug:
+            sys.stderr.write("PARSE ERROR line %s: %s\n" % (
+                self.num_processed, why
+            ))
+
     def _parse_mime(self, raw):
         match = self._mime_splitter.match(raw)
         if not match:
@@ -131,6 +176,360 @@ class AccessParser:
 
         return hdrs
             
+class MmapAccessParser(AccessParser):
+    ''' 
+    Squid Access Logfile Parser that memory-maps a regular file and splits
+    it into lines a block at a time, rather than reading it line by line.
+    Only the fields that squidpeek uses are returned: 'utime', 'elapsed',
+    'log_tag', 'status', 'bytes' and 'url'.
+    
+    Only the lines that start between byte offsets start and end are
+    parsed; see line_range. Lines that skip matches (unless they're broken)
+    are dropped a block at a time, before they're split into fields.
+    '''
+
+    block_size = 1024 * 1024
+
+    def __init__(self, file_descriptor, start=0, end=None, debug=False, skip=None):
+        import mmap
+        AccessParser.__init__(self, file_descriptor, debug=debug, skip=skip)
+        size = os.fstat(file_descriptor.fileno()).st_size
+        if end is None or end > size:
+            end = size
+        if size:
+            self._map = mmap.mmap(file_descriptor.fileno(), size, access=mmap.ACCESS_READ)
+        else: # can't map an empty file
+            self._map = ''
+        if start > 0:
+            newline = self._map.find('\n', start - 1)
+            if newline == -1:
+                start = size
+            else:
+                start = newline + 1
+        self._lines = self._scan(start, end)
+
+    def _scan(self, pos, end):
+        buf = self._map
+        size = len(buf)
+        if 0 < end < size: # finish with the line that starts before end
+            newline = buf.find('\n', end - 1)
+            if newline == -1:
+                end = size
+            else:
+                end = newline + 1
+        skip = self.skip
+        while pos < end:
+            stop = pos + self.block_size
+            if stop >= end:
+                stop = end
+            else: # finish the block at the end of a line
+                newline = buf.find('\n', stop)
+                if newline == -1:
+                    stop = end
+                else:
+                    stop = newline + 1
+            lines = buf[pos:stop].split('\n')
+            if not lines[-1]:
+                lines.pop() # the block ended with a newline
+            if skip is not None:
+                kept = self._drop_skippable(lines)
+                self.num_processed += len(lines) - len(kept)
+                lines = kept
+            for line in lines:
+                yield line
+            pos = stop
+
+    def next(self):
+        lines = self._lines
+        while 1:     # loop until we find a valid line, or end
+            line = lines.next()
+            self.num_processed += 1
+            try:
+                return self._parse(line)
+            except Exception, why:
+                self._error(why)
+                continue        
+
+    def _parse(self, line):
+        n = line.split(None, 10)
+        log_tag, status = n[3].split('/', 2)
+        if n[8].count('/') != 1 or len(n) < 10: # peer_tag/peerhost, mimetype
+            raise ValueError, "bad peer or mimetype"
+        return {
+            'utime': int(float(n[0])),
+            'elapsed': int(n[1]),
+            'log_tag': log_tag,
+            'status': int(status),
+            'bytes': int(n[4]),
+            'url': n[6],
+        }
+
+
+# lines that every parser here can read (though some others can be, too)
+_well_formed = compile(r'[ \t]*\d{1,15}(?:\.\d*)?[ \t]+\d+[ \t]+\S+[ \t]+[^/\s]*/\d+[ \t]+\d+'
+                       r'[ \t]+\S+[ \t]+\S+[ \t]+\S+[ \t]+[^/\s]*/[^/\s]*[ \t]+\S')
+
+_error_causes = {
+    IndexError: "too few fields",
+    ValueError: "unparseable field",
+}
+
+def is_regular_file(fd):
+    '''
+    Return whether fd is an open regular file (rather than, e.g., a pipe).
+    '''
+    import stat
+    try:
+        return stat.S_ISREG(os.fstat(fd.fileno()).st_mode)
+    except (AttributeError, EnvironmentError, ValueError):
+        return False
+
+def line_range(fd, start=0, end=None):
+    '''
+    Iterate over the lines in the seekable file fd that start at or after
+    byte offset start and before end (default: the end of the file).
+    '''
+    if start > 0:
+        fd.seek(start - 1)
+        fd.readline() # skip the tail of the line that straddles start
+    else:
+        fd.seek(0)
+    pos = fd.tell()
+    while end is None or pos < end:
+        line = fd.readline()
+        if not line:
+            break
+        pos += len(line)
+        yield line
+
+def byte_ranges(path, num, start=0, end=None):
+    '''
+    Split the file at path (or the part of it between start and end) into
+    num (start, end) byte ranges; use with line_range to process each range
+    separately.
+    '''
+    if end is None:
+        end = os.path.getsize(path)
+    step = (end - start) / num + 1
+    return [(pos, min(pos + step, end)) for pos in xrange(start, end, step)]
+
+def complete_end(fd, end):
+    '''
+    Return the byte offset just after the last complete (newline-terminated)
+    line in the seekable file fd that ends at or before end.
+    '''
+    pos = end
+    while pos > 0:
+        step = min(pos, 8192)
+        fd.seek(pos - step)
+        i = fd.read(step).rfind('\n')
+        if i != -1:
+            return pos - step + i + 1
+        pos -= step
+    return 0
+
+
+def line_filter(skip_tags=(), methods=(), hosts=(), url_prefixes=(), clients=(),
+                status_classes=(), log_tags=()):
+    '''
+    Return a compiled regex that matches the raw lines that needn't be
+    parsed: ones whose log tag starts with one of skip_tags, and, for each
+    of the rest that's given, ones that don't match any of its values:
+
+      methods         request methods, e.g. "GET"
+      hosts           the URL's host (or host:port), in any case;
+                      "*.example.com" is any host in example.com
+      url_prefixes    the start of the URL
+      clients         client addresses, or IPv4 subnets like "10.1.0.0/16"
+      status_classes  the status code's first digit, e.g. "5"
+      log_tags        log tags, e.g. "TCP_MISS"
+
+    Lines that are too broken to tell are left for the parser to count as
+    errors, and so are broken lines that it matches; the parsers only drop
+    the ones they could have read. Returns None if there's nothing to skip; raises ValueError if a
+    value can't be used.
+    '''
+    field = lambda n: r'[ \t]*(?:\S+[ \t]+){%i}' % n # the start of the nth field
+    patterns = []
+    if skip_tags:
+        patterns.append(field(3) + _any(skip_tags))
+    if log_tags:
+        patterns.append(field(3) + '(?!%s/)' % _any(log_tags))
+    if status_classes:
+        for status_class in status_classes:
+            if len(status_class) != 1 or not status_class.isdigit():
+                raise ValueError, "bad status class: %s" % status_class
+        patterns.append(field(3) + r'[^/\s]*/(?![%s]\d*[ \t])' % "".join(status_classes))
+    if clients:
+        patterns.append(field(2) + r'(?!(?:%s)[ \t])' % "|".join(map(_client_pattern, clients)))
+    if methods:
+        patterns.append(field(5) + r'(?!%s[ \t])' % _any(methods))
+    if url_prefixes:
+        patterns.append(field(6) + '(?!%s)' % _any(url_prefixes))
+    if hosts:
+        patterns.append(field(6) + 
+          r'(?!(?:[A-Za-z][A-Za-z0-9+.-]*://)?(?:[^/\s@]*@)?(?:%s)(?:[/?#;\s]|$))' % 
+          "|".join(map(_host_pattern, hosts)))
+    if not patterns:
+        return None
+    return compile("|".join(patterns))
+
+def _any(values):
+    return "(?:%s)" % "|".join(map(escape, values))
+
+def _host_pattern(host):
+    if host.startswith('*.'):
+        pattern = r'[^/\s:@]+\.' + _caseless(host[2:])
+    else:
+        pattern = _caseless(host)
+    if ':' not in host:
+        pattern += r'(?::\d+)?'
+    return pattern
+
+def _caseless(text):
+    "Escape text, matching its letters in either case."
+    return "".join([char.isalpha() and "[%s%s]" % (char.lower(), char.upper()) or escape(char)
+                    for char in text])
+
+def _client_pattern(client):
+    if '/' not in client:
+        return escape(client)
+    try:
+        address, bits = client.split('/')
+        octets = [int(octet) for octet in address.split('.')]
+        bits = int(bits)
+        if len(octets) != 4 or not 0 <= bits <= 32 or [o for o in octets if not 0 <= o <= 255]:
+            raise ValueError
+    except ValueError:
+        raise ValueError, "bad client subnet (only IPv4 ones can be used): %s" % client
+    whole, part = divmod(bits, 8)
+    patterns = [str(octet) for octet in octets[:whole]]
+    if part:
+        low = octets[whole] & (0xff << (8 - part)) & 0xff
+        patterns.append("(?:%s)" % "|".join([str(o) for o in range(low, low + (1 << (8 - part)))]))
+    patterns.extend([r'\d+'] * (4 - len(patterns)))
+    return r'\.'.join(patterns)
+
+def time_offset(fd, utime, start=0, end=None, index=None):
+    '''
+    Return the byte offset in the seekable file fd (between start and end)
+    that the lines at or after utime start from, for line_range and 
+    MmapAccessParser, by bisecting it; lines have to be in time order, 
+    although ones without a time are skipped. If index (a TimeIndex) is 
+    given, its checkpoints narrow the search, and the lines read are
+    added to it.
+    '''
+    if end is None:
+        end = os.fstat(fd.fileno()).st_size
+    low, high = start, end
+    if index is not None:
+        low, high = index.narrow(utime, low, high)
+    while low < high:
+        mid = (low + high) // 2
+        line_start, line_end, line_time = _timed_line(fd, mid, high)
+        if line_time is None or line_time >= utime:
+            high = mid
+        else:
+            low = line_end
+        if index is not None and line_time is not None:
+            index.add(line_start, line_end, line_time)
+    return low
+
+def _timed_line(fd, pos, end):
+    '''
+    Return the (start, end, time) of the first complete line in fd that
+    starts at or after pos and before end and has a time, or 
+    (end, end, None) if there isn't one.
+    '''
+    if pos > 0:
+        fd.seek(pos - 1)
+        pos = pos - 1 + len(fd.readline()) # skip the line that straddles pos
+    else:
+        fd.seek(0)
+    while pos < end:
+        line = fd.readline()
+        if not line.endswith('\n'):
+            break # the end of the file, or a line still being written
+        try:
+            return pos, pos + len(line), float(line.split(None, 1)[0])
+        except (IndexError, ValueError):
+            pos += len(line)
+    return end, end, None
+
+
+class TimeIndex:
+    '''
+    Checkpoints of the times of lines in a log file, open as fd; they're
+    read from and saved to path. Since logs are only appended to, they 
+    stay good until the file is replaced (e.g., rotated) or truncated, 
+    when they're forgotten.
+    '''
+
+    version = 1
+    max_checkpoints = 4096
+
+    def __init__(self, path, fd):
+        import json
+        self.path = path
+        st = os.fstat(fd.fileno())
+        self.inode = [st.st_dev, st.st_ino]
+        self.size = st.st_size
+        self.checkpoints = {} # line start -> (line end, time)
+        self.changed = False
+        try:
+            saved = json.load(open(path))
+        except (IOError, ValueError):
+            return
+        if saved.get('version') == self.version and saved.get('inode') == self.inode \
+          and saved.get('size', self.size + 1) <= self.size:
+            for line_start, line_end, line_time in saved['checkpoints']:
+                self.checkpoints[line_start] = (line_end, line_time)
+
+    def add(self, line_start, line_end, line_time):
+        "Remember that the line from line_start to line_end is at line_time."
+        if line_start not in self.checkpoints:
+            self.checkpoints[line_start] = (line_end, line_time)
+            self.changed = True
+
+    def narrow(self, utime, low, high):
+        '''
+        Return the part of the range low to high that lines at utime 
+        can start in, going by the checkpoints.
+        '''
+        for line_start, (line_end, line_time) in self.checkpoints.iteritems():
+            if line_time < utime:
+                if low < line_end <= high:
+                    low = line_end
+            elif low <= line_start < high:
+                high = line_start
+        return low, max(low, high)
+
+    def save(self):
+        "Save the checkpoints to path (atomically), if there are new ones."
+        import json
+        if not self.changed:
+            return
+        starts = sorted(self.checkpoints)
+        if len(starts) > self.max_checkpoints: # thin them out evenly
+            starts = starts[::len(starts) // self.max_checkpoints + 1]
+        tmp_path = "%s.tmp%s" % (self.path, os.getpid())
+        fh = open(tmp_path, 'w')
+        try:
+            json.dump({
+                'version': self.version,
+                'inode': self.inode,
+                'size': self.size,
+                'checkpoints': [(s,) + self.checkpoints[s] for s in starts],
+            }, fh)
+            fh.close()
+            os.rename(tmp_path, self.path)
+        except:
+            fh.close()
+            os.unlink(tmp_path)
+            raise
+        self.changed = False
+
+            
 def test_access():
     log = AccessParser(sys.stdin)
     for line in log:
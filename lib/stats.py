@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+stats.py - Run statistics: time spent in each stage, and counters
+
+Nothing is recorded until enable() is called; until then, start() and 
+stop() do next to nothing, and timed() returns the function it's given, so
+it costs nothing to leave the calls in place.
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+
+import os
+import sys
+import time
+
+enabled = False
+stages = {} # name -> [calls, wall seconds, CPU seconds]
+counters = {}
+_order = [] # stage names, in the order they were first seen
+
+def enable():
+    "Start recording."
+    global enabled
+    enabled = True
+
+def _cpu():
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3] # including children
+
+def start(name):
+    "Start timing the stage name; pass what's returned to stop()."
+    if not enabled:
+        return None
+    return (name, time.time(), _cpu())
+
+def stop(token):
+    "Stop timing a stage started with start()."
+    if token is None:
+        return
+    name, wall, cpu = token
+    _add(name, time.time() - wall, _cpu() - cpu)
+
+def _add(name, wall, cpu=None):
+    try:
+        stage = stages[name]
+    except KeyError:
+        stage = stages[name] = [0, 0.0, None]
+        _order.append(name)
+    stage[0] += 1
+    stage[1] += wall
+    if cpu is not None:
+        stage[2] = (stage[2] or 0.0) + cpu
+
+def timed(name, func):
+    """
+    Return a version of func whose calls are timed (wall time only) as the
+    stage name, or func itself if recording isn't enabled.
+    """
+    if not enabled:
+        return func
+    now = time.time
+    def timed_func(*args, **kw):
+        begin = now()
+        try:
+            return func(*args, **kw)
+        finally:
+            _add(name, now() - begin)
+    timed_func.__name__ = func.__name__
+    return timed_func
+
+def instrument(namespace, func_name, name):
+    """
+    Replace the function called func_name in namespace (e.g., a module's 
+    globals()) with a timed() version, recorded as the stage name.
+    """
+    namespace[func_name] = timed(name, namespace[func_name])
+
+def count(name, value=1):
+    "Add value to the counter name."
+    if enabled:
+        counters[name] = counters.get(name, 0) + value
+
+def record(name, value):
+    "Set the counter name to value (e.g., a dict of counts)."
+    if enabled:
+        counters[name] = value
+
+def results():
+    "Return everything recorded so far, as a dict."
+    out = {'stages': {}, 'counters': counters.copy()}
+    for name in _order:
+        calls, wall, cpu = stages[name]
+        out['stages'][name] = {'calls': calls, 'wall': round(wall, 6)}
+        if cpu is not None:
+            out['stages'][name]['cpu'] = round(cpu, 6)
+    if counters.get('lines') and stages.has_key('parse') and stages['parse'][1]:
+        out['counters']['lines_per_sec'] = int(counters['lines'] / stages['parse'][1])
+    return out
+
+def dump(dest):
+    "Write the results as JSON to the file at dest, or STDERR if it's '-'."
+    import json
+    text = json.dumps(results(), indent=1, sort_keys=True)
+    if dest == '-':
+        sys.stderr.write(text + "\n")
+    else:
+        out = open(dest, 'w')
+        try:
+            out.write(text + "\n")
+        finally:
+            out.close()
+
+def html():
+    "Return the results as an HTML table."
+    data = results()
+    lines = ["<table class='stats'>",
+             "<tr><th>stage</th><th>calls</th><th>wall sec</th><th>CPU sec</th></tr>"]
+    for name in _order:
+        stage = data['stages'][name]
+        if stage.has_key('cpu'):
+            cpu = "%.3f" % stage['cpu']
+        else:
+            cpu = ""
+        lines.append("<tr><th>%s</th><td>%i</td><td>%.3f</td><td>%s</td></tr>" % (
+            name, stage['calls'], stage['wall'], cpu))
+    names = data['counters'].keys()
+    names.sort()
+    for name in names:
+        value = data['counters'][name]
+        if isinstance(value, dict):
+            value = ", ".join(["%s: %s" % item for item in sorted(value.items())]) or "none"
+        lines.append("<tr><th>%s</th><td colspan='3'>%s</td></tr>" % (name, value))
+    lines.append("</table>")
+    return "\n".join(lines)
+
+
+def test():
+    enable()
+    token = start('sleep')
+    time.sleep(0.1)
+    stop(token)
+    slow = timed('sum', sum)
+    for i in xrange(1000):
+        slow(range(100))
+    count('things', 3)
+    dump('-')
+
+if __name__ == '__main__':
+    test()
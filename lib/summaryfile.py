@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+
+"""
+summaryfile.py - Binary file format for squidpeek's log summaries
+
+A summary file is a fixed-width header, a table of contents, and sections,
+each an array of fixed-width, little-endian values:
+
+    header:   magic ("SQPKSUMM"), format version (uint16), flags (uint16,
+              unused), number of sections (uint32)
+    contents: for each section, its name (16 bytes, NUL-padded), type
+              ("s" for bytes, or a struct code), 7 bytes of padding, then its
+              offset and number of items (uint64 each)
+    sections: each starting on an eight-byte boundary
+
+The "meta" section is JSON, holding the summary's totals and settings. The
+per-URL statistics are in columns, one row per hot URL; variable-length
+ones (URLs, histogram buckets, queries) are packed end to end, with an
+"index" column of n + 1 offsets into them; the HyperLogLogs, count-min
+sketches and floors of URLs whose queries are sketched are only kept for
+those rows. Histograms and timelines are
+sparse; only the buckets with something in them are kept, as their index
+and count.
+
+Files are memory-mapped when read, and a URL's statistics are only turned
+into objects when they're first used; see read().
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+import os
+import sys
+import mmap
+import json
+from array import array
+from struct import Struct
+
+MAGIC = 'SQPKSUMM'
+FORMAT_VERSION = 4
+
+_header = Struct('<8sHHI')
+_entry = Struct('<16sc7xQQ')
+_sizes = {'s': 1, 'B': 1, 'I': 4, 'Q': 8, 'q': 8}
+_histograms = ['kbytes', 'elapsed']
+
+
+def write(path, summary, extra=None):
+    """
+    Atomically replace the file at path with summary (a LogSummary), and 
+    extra (a dict of anything else that can be JSON-encoded).
+    """
+    from squidpeek_lib.hyperloglog import HyperLogLog
+    hot_urls = summary.hot_urls
+    keys = hot_urls.keys()
+    rows = [hot_urls.values.get(key) or summary.new_url_stats() for key in keys]
+    meta = {
+        'ignore_query': summary.ignore_query,
+        'num_processed': summary.num_processed,
+        'num_error': summary.num_error,
+        'num_skipped': summary.num_skipped,
+        'filters': summary.filters,
+        'errors': summary.errors,
+        'first_utime': summary.first_utime,
+        'last_utime': summary.last_utime,
+        'capacity': hot_urls.capacity,
+        'floor': hot_urls.floor(),
+        'evictions': hot_urls.evictions,
+        'extra': extra or {},
+    }
+    sections = []
+    if isinstance(summary.urls, HyperLogLog):
+        meta['urls'] = summary.urls.precision
+        sections.append(('urls', 's', str(summary.urls.registers)))
+    else:
+        meta['urls'] = None
+        sections.append(('urls', 's', ''.join(summary.urls)))
+    if summary.sketch is None:
+        meta['sketch'] = None
+    else:
+        meta['sketch'] = [summary.sketch.width, summary.sketch.depth]
+        sections.append(('sketch', 'I', summary.sketch.table))
+
+    sections.append(('url_index', 'Q', _index([len(key) for key in keys])))
+    sections.append(('url_text', 's', ''.join(keys)))
+    sections.append(('count', 'Q', [hot_urls.count(key) for key in keys]))
+    sections.append(('error', 'Q', [hot_urls.error(key) for key in keys]))
+    for name in ['status', 'types']:
+        width = max([max(row[name] or [0]) for row in rows] or [0]) + 1
+        meta[name] = width
+        table = [0] * (width * len(rows))
+        for i, row in enumerate(rows):
+            for k, count in row[name].iteritems():
+                table[i * width + k] = count
+        sections.append((name, 'Q', table))
+
+    for name in _histograms:
+        states = [row[name].__getstate__() for row in rows]
+        meta[name] = states and states[0][:2] or [6, 1] # sub_bits, unit
+        buckets, counts, sizes = [], [], []
+        for state in states:
+            found = [(i, count) for i, count in enumerate(array('L', state[2])) if count]
+            buckets.extend([i for i, count in found])
+            counts.extend([count for i, count in found])
+            sizes.append(len(found))
+        sections.append((name + '_index', 'Q', _index(sizes)))
+        sections.append((name + '_bucket', 'I', buckets))
+        sections.append((name, 'I', counts))
+        sections.append((name + '_totals', 'Q', [n for state in states for n in state[3:5]]))
+        sections.append((name + '_range', 'q', [_none(n) for state in states for n in state[5:7]]))
+
+    states = [row['timeline'].__getstate__() for row in rows]
+    meta['timeline'] = states and states[0][0] or 60 # size
+    sections.append(('timeline_at', 'q', [_none(n) for state in states for n in state[1:3]]))
+    slots, counts, sizes = [], [], []
+    for state in states:
+        found = [(i, count) for i, count in enumerate(array('I', ''.join(state[3:]))) if count]
+        slots.extend([i for i, count in found])
+        counts.extend([count for i, count in found])
+        sizes.append(len(found))
+    sections.append(('timeline_index', 'Q', _index(sizes)))
+    sections.append(('timeline_slot', 'I', slots))
+    sections.append(('timeline', 'I', counts))
+
+    kinds, sizes, hashes, counts, errors, hll, cms, floors = [], [], [], [], [], [], [], []
+    for row in rows:
+        queries = row['query']
+        if row['query_distinct'] is None:
+            kinds.append(0)
+            items = [(q, count, 0) for q, count in queries.iteritems()]
+        else:
+            kinds.append(1)
+            meta['query_capacity'] = queries.capacity
+            meta['query_precision'] = row['query_distinct'].precision
+            meta['query_sketch'] = [row['query_sketch'].width, row['query_sketch'].depth]
+            items = [(q, queries.count(q), queries.error(q)) for q in queries.keys()]
+            hll.append(str(row['query_distinct'].registers))
+            cms.extend(row['query_sketch'].table)
+            floors.append(queries.floor())
+        sizes.append(len(items))
+        for q, count, error in items:
+            hashes.append(q)
+            counts.append(count)
+            errors.append(error)
+    sections.append(('query_kind', 'B', kinds))
+    sections.append(('query_index', 'Q', _index(sizes)))
+    sections.append(('query_hash', 's', ''.join(hashes)))
+    sections.append(('query_count', 'Q', counts))
+    sections.append(('query_error', 'Q', errors))
+    sections.append(('query_hll', 's', ''.join(hll)))
+    sections.append(('query_sketch', 'I', cms))
+    sections.append(('query_floor', 'Q', floors))
+    sections.insert(0, ('meta', 's', json.dumps(meta)))
+
+    tmp_file = "%s.tmp%s" % (path, os.getpid())
+    out = open(tmp_file, 'wb')
+    try:
+        _write_sections(out, sections)
+    finally:
+        out.close()
+    os.rename(tmp_file, path)
+
+def _write_sections(out, sections):
+    offset = _header.size + _entry.size * len(sections)
+    contents = []
+    data = []
+    for name, typecode, values in sections:
+        offset += -offset % 8
+        packed = _pack(typecode, values)
+        contents.append(_entry.pack(name, typecode, offset, len(packed) / _sizes[typecode]))
+        data.append(packed)
+        offset += len(packed)
+    out.write(_header.pack(MAGIC, FORMAT_VERSION, 0, len(sections)))
+    out.write(''.join(contents))
+    written = _header.size + _entry.size * len(sections)
+    for packed in data:
+        out.write('\0' * (-written % 8))
+        written += -written % 8
+        out.write(packed)
+        written += len(packed)
+
+def _pack(typecode, values):
+    if typecode == 's':
+        return values
+    if typecode in 'BI':
+        values = array(typecode, values)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values.tostring()
+    return Struct('<%i%s' % (len(values), typecode)).pack(*values)
+
+def _index(sizes):
+    "Return the offsets of items of sizes, packed end to end, and the end."
+    index = [0]
+    for size in sizes:
+        index.append(index[-1] + size)
+    return index
+
+def _none(value):
+    if value is None:
+        return -1
+    return value
+
+
+def read(path, summary):
+    """
+    Load the summary file at path into summary (a new LogSummary), and
+    return the extra data saved with it. Raises ValueError if it isn't a
+    summary file that this version can read.
+
+    The hot URLs' counts are read straight away, but the rest of their 
+    statistics stay in the file (which is memory-mapped) until they're
+    looked up.
+    """
+    from squidpeek_lib.spacesaving import SpaceSaving
+    from squidpeek_lib.hyperloglog import HyperLogLog
+    from squidpeek_lib.countmin import CountMinSketch
+    data = SummaryFile(path)
+    meta = data.meta
+    summary.ignore_query = meta['ignore_query']
+    summary.num_processed = meta['num_processed']
+    summary.num_error = meta['num_error']
+    summary.num_skipped = meta['num_skipped']
+    summary.filters = dict([(str(name), [value.encode('utf-8') for value in values])
+                            for name, values in meta['filters'].items()])
+    summary.errors = meta['errors']
+    summary.first_utime = meta['first_utime']
+    summary.last_utime = meta['last_utime']
+    if meta['urls'] is None:
+        urls = data.bytes('urls')
+        summary.urls = set([urls[i:i + 16] for i in xrange(0, len(urls), 16)])
+    else:
+        summary.urls = HyperLogLog(meta['urls'])
+        summary.urls.registers = bytearray(data.bytes('urls'))
+    if meta['sketch'] is None:
+        summary.sketch = None
+    else:
+        summary.sketch = CountMinSketch(*meta['sketch'])
+        summary.sketch.table = data.column('sketch')
+    index = data.column('url_index')
+    text = data.bytes('url_text')
+    keys = [intern(text[index[i]:index[i + 1]]) for i in xrange(len(index) - 1)]
+    summary.hot_urls = SpaceSaving.from_counts(meta['capacity'], 
+        dict(zip(keys, data.column('count'))), dict(zip(keys, data.column('error'))),
+        MappedStats(data, dict(zip(keys, xrange(len(keys))))), meta['floor'])
+    summary.hot_urls.evictions = meta['evictions']
+    return meta['extra']
+
+
+class SummaryFile(object):
+    "The sections of a memory-mapped summary file."
+
+    def __init__(self, path):
+        fh = open(path, 'rb')
+        try:
+            head = fh.read(_header.size)
+            if len(head) < _header.size or head[:8] != MAGIC:
+                raise ValueError, "%s isn't a squidpeek summary" % path
+            magic, version, flags, num_sections = _header.unpack(head)
+            if version != FORMAT_VERSION:
+                raise ValueError, "%s is in summary format %i; this version reads %i" % (
+                    path, version, FORMAT_VERSION)
+            self.map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fh.close()
+        self.sections = {}
+        for i in xrange(num_sections):
+            name, typecode, offset, count = _entry.unpack_from(
+                self.map, _header.size + i * _entry.size)
+            self.sections[name.rstrip('\0')] = (typecode, offset, count)
+        self.meta = json.loads(self.bytes('meta'))
+        self._columns = {}
+
+    def bytes(self, name, start=0, end=None):
+        "Return the bytes from start to end in the section called name."
+        typecode, offset, count = self.sections[name]
+        if end is None:
+            end = count
+        return self.map[offset + start:offset + end]
+
+    def column(self, name, start=0, end=None):
+        """
+        Return the values from start to end in the section called name, as
+        an array or (for 64-bit values) a tuple.
+        """
+        typecode, offset, count = self.sections[name]
+        if end is None:
+            end = count
+        size = _sizes[typecode]
+        if typecode in 'BI':
+            values = array(typecode, self.map[offset + start * size:offset + end * size])
+            if sys.byteorder == 'big':
+                values.byteswap()
+            return values
+        return Struct('<%i%s' % (end - start, typecode)).unpack_from(
+            self.map, offset + start * size)
+
+    def cached(self, name):
+        "Return the whole of column(name), reading it only once."
+        try:
+            return self._columns[name]
+        except KeyError:
+            values = self._columns[name] = self.column(name)
+            return values
+
+    def url_stats(self, row):
+        "Return the statistics for the URL in row, in the form LogSummary keeps them."
+        from squidpeek_lib.loghistogram import LogHistogram
+        from squidpeek_lib.timeline import Timeline
+        meta = self.meta
+        stats = {}
+        for name in ['status', 'types']:
+            width = meta[name]
+            values = self.column(name, row * width, (row + 1) * width)
+            stats[name] = dict([(k, count) for k, count in enumerate(values) if count])
+        for name in _histograms:
+            index = self.cached(name + '_index')
+            total, sum = self.column(name + '_totals', row * 2, row * 2 + 2)
+            low, high = [_unnone(n) for n in self.column(name + '_range', row * 2, row * 2 + 2)]
+            found = self.column(name + '_bucket', index[row], index[row + 1])
+            buckets = array('L', [0]) * (found and found[-1] + 1 or 0)
+            for i, count in zip(found, self.column(name, index[row], index[row + 1])):
+                buckets[i] = count
+            stats[name] = LogHistogram()
+            stats[name].__setstate__(tuple(meta[name]) + (buckets.tostring(), total, sum, low, high))
+        size = meta['timeline']
+        width, start = [_unnone(n) for n in self.column('timeline_at', row * 2, row * 2 + 2)]
+        index = self.cached('timeline_index')
+        counts = array('I', [0]) * (size * 3)
+        for i, count in zip(self.column('timeline_slot', index[row], index[row + 1]),
+                            self.column('timeline', index[row], index[row + 1])):
+            counts[i] = count
+        counts = counts.tostring()
+        stats['timeline'] = Timeline()
+        stats['timeline'].__setstate__((size, width, start, counts[:size * 4], 
+                                        counts[size * 4:size * 8], counts[size * 8:]))
+        index = self.cached('query_index')
+        first, last = index[row], index[row + 1]
+        hashes = self.bytes('query_hash', first * 8, last * 8)
+        hashes = [hashes[i:i + 8] for i in xrange(0, len(hashes), 8)]
+        counts = self.column('query_count', first, last)
+        if self.cached('query_kind')[row] == 0:
+            stats['query'] = dict(zip(hashes, counts))
+            stats['query_distinct'] = None
+            stats['query_sketch'] = None
+        else:
+            from squidpeek_lib.spacesaving import SpaceSaving
+            from squidpeek_lib.hyperloglog import HyperLogLog
+            from squidpeek_lib.countmin import CountMinSketch
+            errors = self.column('query_error', first, last)
+            hll_row = self._hll_rows()[row]
+            stats['query'] = SpaceSaving.from_counts(meta['query_capacity'],
+                dict(zip(hashes, counts)), dict(zip(hashes, errors)), None,
+                self.column('query_floor', hll_row, hll_row + 1)[0])
+            stats['query_distinct'] = HyperLogLog(meta['query_precision'])
+            registers = len(stats['query_distinct'].registers)
+            stats['query_distinct'].registers = bytearray(
+                self.bytes('query_hll', hll_row * registers, (hll_row + 1) * registers))
+            sketch = stats['query_sketch'] = CountMinSketch(*meta['query_sketch'])
+            cells = len(sketch.table)
+            sketch.table = self.column('query_sketch', hll_row * cells, (hll_row + 1) * cells)
+        return stats
+
+    def _hll_rows(self):
+        "Return, for each row, how many rows before it have a HyperLogLog."
+        try:
+            return self._columns['hll_rows']
+        except KeyError:
+            rows = []
+            seen = 0
+            for kind in self.cached('query_kind'):
+                rows.append(seen)
+                seen += kind
+            self._columns['hll_rows'] = rows
+            return rows
+
+
+class MappedStats(object):
+    """
+    A dict-like mapping of URLs to their statistics, which are read from a
+    SummaryFile (given rows, a dict of URL -> row) the first time they're 
+    looked up. Only what SpaceSaving and LogSummary need is supported.
+    """
+
+    def __init__(self, data, rows):
+        self._data = data
+        self._rows = rows
+        self._loaded = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._loaded[key]
+        except KeyError:
+            stats = self._loaded[key] = self._data.url_stats(self._rows[key])
+            return stats
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        self._loaded[key] = value
+
+    def __contains__(self, key):
+        return key in self._loaded or key in self._rows
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self._loaded.pop(key, None)
+        self._rows.pop(key, None)
+        return value
+
+    def keys(self):
+        keys = dict.fromkeys(self._rows)
+        keys.update(self._loaded)
+        return keys.keys()
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __reduce__(self):
+        # when pickled, e.g. to send to another process, it becomes a dict
+        return (dict, ([(key, self[key]) for key in self.keys()],))
+
+
+def _unnone(value):
+    if value == -1:
+        return None
+    return value
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""
+timeline.py - Fixed-size counts of activity over time
+"""
+
+__license__ = """
+Copyright (c) 2013 Mark Nottingham <mnot@pobox.com>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__version__ = '0.1'
+
+from array import array
+
+
+class Timeline(object):
+    """
+    Counts of requests, misses and server errors over time, in size buckets
+    of width seconds each.
+
+    Buckets start out width (by default, a minute) wide; when something is
+    added that doesn't fit, they're doubled in width (pairs of them being
+    added together) until it does. Memory use is therefore fixed, and a
+    timeline covers the whole time it's seen at the finest resolution that
+    fits. Buckets line up with multiples of their width since the epoch, so
+    timelines can be merged whatever order they were filled in.
+    """
+    __slots__ = ['size', 'width', 'start', 'requests', 'misses', 'errors']
+
+    def __init__(self, size=60, width=60):
+        self.size = size
+        self.width = width
+        self.start = None # the bucket number (time / width) of the first slot
+        self.requests = array('I', [0]) * size
+        self.misses = array('I', [0]) * size
+        self.errors = array('I', [0]) * size
+
+    def __getstate__(self):
+        return (self.size, self.width, self.start, self.requests.tostring(),
+                self.misses.tostring(), self.errors.tostring())
+
+    def __setstate__(self, state):
+        self.size, self.width, self.start, requests, misses, errors = state
+        self.requests = array('I', requests)
+        self.misses = array('I', misses)
+        self.errors = array('I', errors)
+
+    def add(self, utime, requests=1, misses=0, errors=0):
+        "Count requests, misses and errors at utime (in seconds since the epoch)."
+        bucket = int(utime) // self.width
+        if self.start is None:
+            self.start = bucket
+        i = bucket - self.start
+        if not 0 <= i < self.size:
+            self._fit(bucket, bucket, self.width)
+            i = int(utime) // self.width - self.start
+        self.requests[i] += requests
+        self.misses[i] += misses
+        self.errors[i] += errors
+
+    def merge(self, other):
+        "Add the counts from another Timeline of the same size to this one."
+        if other.start is None:
+            return
+        if self.start is None:
+            self.width, self.start = other.width, other.start
+        first, last = other._used()
+        self._fit(first, last, other.width)
+        factor = self.width // other.width
+        for j in xrange(other.size):
+            if other.requests[j]:
+                i = (other.start + j) // factor - self.start
+                self.requests[i] += other.requests[j]
+                self.misses[i] += other.misses[j]
+                self.errors[i] += other.errors[j]
+
+    def _used(self):
+        "Return the first and last bucket numbers with anything in them."
+        used = [j for j in xrange(self.size) if self.requests[j]] or [0]
+        return self.start + used[0], self.start + used[-1]
+
+    def _fit(self, first, last, width):
+        """
+        Widen the buckets (if need be) and move them, so that they cover
+        bucket numbers first to last of width seconds as well as what's
+        already been counted.
+        """
+        new_width = max(width, self.width)
+        used_first, used_last = self._used()
+        theirs, ours = new_width // width, new_width // self.width
+        low = min(first // theirs, used_first // ours)
+        high = max(last // theirs, used_last // ours)
+        while high - low >= self.size:
+            low, high, new_width = low // 2, high // 2, new_width * 2
+        self._rebase(new_width, low)
+
+    def _rebase(self, width, start):
+        "Move the counts into buckets of width seconds, starting at start."
+        if (width, start) == (self.width, self.start):
+            return
+        factor = width // self.width
+        requests = array('I', [0]) * self.size
+        misses = array('I', [0]) * self.size
+        errors = array('I', [0]) * self.size
+        for j in xrange(self.size):
+            if self.requests[j]:
+                i = (self.start + j) // factor - start
+                requests[i] += self.requests[j]
+                misses[i] += self.misses[j]
+                errors[i] += self.errors[j]
+        self.width, self.start = width, start
+        self.requests, self.misses, self.errors = requests, misses, errors
+
+    def peak(self):
+        "Return the most requests in a bucket, and when that bucket starts."
+        count = max(self.requests)
+        return count, (self.start + list(self.requests).index(count)) * self.width
+
+    def img(self, first_utime, last_utime, width=80, height=20, 
+            color=(192,192,192,255), miss_color=(32,32,128,255), 
+            error_color=(128,32,32,255), bg_color=(255,255,255,0)):
+        """
+        Return a data: URI for a sparkline of requests from first_utime to
+        last_utime, with misses and server errors drawn over them. Buckets 
+        are widened as much as they'd need to be to cover the whole time,
+        so that timelines for the same times line up with each other.
+        """
+        from squidpeek_lib.canvas import new_canvas
+        bucket_width = self.width
+        first, last = int(first_utime) // bucket_width, int(last_utime) // bucket_width
+        while last - first >= self.size:
+            first, last, bucket_width = first // 2, last // 2, bucket_width * 2
+        factor = bucket_width // self.width
+        num_columns = last - first + 1
+        requests = [0] * num_columns
+        misses = [0] * num_columns
+        errors = [0] * num_columns
+        for j in xrange(self.size):
+            if self.requests[j]:
+                i = (self.start + j) // factor - first
+                if 0 <= i < num_columns:
+                    requests[i] += self.requests[j]
+                    misses[i] += self.misses[j]
+                    errors[i] += self.errors[j]
+        max_value = float(max(requests) or 1)
+        height -= 1
+        canvas = new_canvas(width, height + 1, bg_color)
+        for i in xrange(num_columns):
+            x0 = 1 + i * (width - 2) // num_columns
+            x1 = max(x0, (i + 1) * (width - 2) // num_columns)
+            for counts, this_color in [(requests, color), (misses, miss_color), 
+                                       (errors, error_color)]:
+                y = int(height - (height * (counts[i] / max_value)))
+                if y != height:
+                    canvas.fill(x0, y, x1, height, this_color)
+        return canvas.data_uri()
+
+
+def test():
+    import time
+    now = time.time()
+    tl = Timeline()
+    for i in xrange(10000):
+        tl.add(now + i * 3, 1, i % 3 == 0, i % 50 == 0)
+    print "%i-second buckets; busiest: %i requests" % (tl.width, tl.peak()[0])
+    print tl.img(now, now + 30000)
+
+if __name__ == '__main__':
+    test()
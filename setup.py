@@ -15,13 +15,14 @@ setup(
   packages = ['squidpeek_lib'],
   package_dir = {'squidpeek_lib': 'lib'},
   scripts = ['squidpeek.py'],
-  install_requires = ['PIL > 1.1.4'],
   long_description=open("README.rst").read(),
   classifiers = [
     'Development Status :: 5 - Production/Stable',
     'Intended Audience :: Developers',
     'License :: OSI Approved :: MIT License',
     'Programming Language :: Python',
+    'Programming Language :: Python :: 2 :: Only',
+    'Programming Language :: Python :: 2.7',
     'Topic :: Internet :: WWW/HTTP',
     'Topic :: Internet :: Proxy Servers',
     'Topic :: Internet :: Log Analysis',
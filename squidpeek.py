@@ -38,7 +38,7 @@ import urllib
 import hashlib
 import re
 import socket
-from UserDict import UserDict
+import cgi
 
 
 max_url_len = 96
@@ -96,124 +96,919 @@ status_colors = {
 
 unknown_color = (192,192,192,0)
 
-def main(fh, num_urls=100, ignore_query=True, debug=False):
-    from squidpeek_lib.squidlog import AccessParser as SquidAccessParser
-    from squidpeek_lib.sparkogram import Sparkogram
-    from squidpeek_lib.sparkbar import Sparkbar
-    log = SquidAccessParser(fh, debug=debug)
-    urls = {}
-    hot_urls = CacheDict(urls, max_size=max(2000, 10*num_urls), trim_to=.5)
-    first_utime = None
-    line = {} # if the log is empty...
-    for line in log:
-        if first_utime == None: 
-            first_utime = line['utime']
-        if line['log_tag'][:3] == 'UDP': continue # ignore ICP
-        if line['log_tag'][:9] == 'TCP_ASYNC': continue # ignore async
-        if line.has_key('extra_0'): # assume that the extra field is an url-encoded list of the Link header values. Not brilliant, but...
-            key = parse_link(urllib.unquote(line['extra_0']))
+skipped_tags = ['UDP', 'TCP_ASYNC'] # ICP, and background fetches for stale-while-revalidate
+
+filter_options = [
+    # option, squidlog.line_filter() argument, description
+    ('--method', 'methods', "method"),
+    ('--host', 'hosts', "host"),
+    ('--url-prefix', 'url_prefixes', "URL prefix"),
+    ('--client', 'clients', "client"),
+    ('--status', 'status_classes', "status"),
+    ('--log-tag', 'log_tags', "log tag"),
+]
+
+def main(logs, num_urls=100, ignore_query=True, debug=False, jobs=1, state_file=None,
+         sketch_kb=None, output=None, stats_footer=False, sort='accesses',
+         summary_file=None, db_path=None, since=None, until=None, time_index=False,
+         filters=None):
+    """
+    Report on logs, a list of open log files (or a single one) in order,
+    to STDOUT or the file at output, ranking URLs by sort. jobs and state_file need them to be
+    regular files, and state_file only handles one. If summary_file is set,
+    the summary is saved there for merge() instead. If db_path is set, the
+    summary is also recorded there for trends(). If since and/or until are
+    set, only the lines from since up to until are read, found with
+    time_range(); the logs have to be regular files for that, too. Only
+    the lines that match filters (see LogSummary) are counted.
+    """
+    from squidpeek_lib.squidlog import complete_end
+    from squidpeek_lib import stats
+    if not isinstance(logs, list):
+        logs = [logs]
+    summary_args = {
+        'num_urls': num_urls,
+        'ignore_query': ignore_query,
+        'debug': debug,
+        'sketch_kb': sketch_kb,
+        'filters': filters,
+    }
+    summary = LogSummary(**summary_args)
+    ranges = [(0, None)] * len(logs) # (start, end) byte offsets for each log
+    if state_file:
+        timer = stats.start('load state')
+        fh = logs[0]
+        summary, start = load_state(state_file, fh, summary)
+        ranges = [(start, complete_end(fh, os.fstat(fh.fileno()).st_size))]
+        stats.stop(timer)
+    if since is not None or until is not None:
+        timer = stats.start('find time range')
+        ranges = [time_range(fh, since, until, time_index) for fh in logs]
+        stats.stop(timer)
+    lines_before = summary.num_processed
+    timer = stats.start('parse')
+    if jobs > 1:
+        summary.merge(summarise_parallel(logs, jobs, summary_args, ranges))
+    else:
+        for fh, (start, end) in zip(logs, ranges):
+            summary.parse(fh, start, end)
+    stats.stop(timer)
+    stats.count('lines', summary.num_processed - lines_before)
+    stats.record('URL cache misses', sum([c.misses for c in _url_caches.values()]))
+    if state_file:
+        timer = stats.start('save state')
+        save_state(state_file, logs[0], summary, ranges[0][1])
+        stats.stop(timer)
+    if db_path:
+        timer = stats.start('record history')
+        record_history(db_path, summary)
+        stats.stop(timer)
+    if summary_file:
+        timer = stats.start('save summary')
+        save_summary(summary_file, summary)
+        stats.stop(timer)
+        return
+    if output:
+        write_report(output, summary, num_urls, ignore_query, jobs, stats_footer, sort)
+    else:
+        report(summary, num_urls, ignore_query, jobs, stats_footer=stats_footer, sort=sort)
+
+def merge(paths, num_urls=100, ignore_query=True, jobs=1, sketch_kb=None, output=None,
+          stats_footer=False, sort='accesses', db_path=None, filters=None):
+    """
+    Report on the summaries saved by main() (e.g., on each of several
+    proxies) in the files at paths, as if their logs had been read 
+    together, recording them in db_path if it's set. Raises ValueError if
+    one can't be used.
+    """
+    from squidpeek_lib import stats
+    summary = LogSummary(num_urls, ignore_query, sketch_kb=sketch_kb, filters=filters)
+    for path in paths:
+        timer = stats.start('load summaries')
+        other = load_summary(path)
+        stats.stop(timer)
+        if not summary.compatible(other):
+            raise ValueError, "%s was summarised with different -q, --sketch or filter options" % path
+        timer = stats.start('merge')
+        summary.merge(other)
+        stats.stop(timer)
+    stats.count('summaries', len(paths))
+    if db_path:
+        timer = stats.start('record history')
+        record_history(db_path, summary)
+        stats.stop(timer)
+    if output:
+        write_report(output, summary, num_urls, ignore_query, jobs, stats_footer, sort)
+    else:
+        report(summary, num_urls, ignore_query, jobs, stats_footer=stats_footer, sort=sort)
+
+def trends(db_path, urls=None, num_urls=100, days=7, output=None):
+    """
+    Report on how URLs have changed over the last days of the periods
+    recorded in the SQLite database at db_path by --db, to STDOUT or the
+    file at output, without reading any logs. It shows the num_urls that
+    moved the most in the latest period and the busiest ones, or just
+    urls if they're given. Raises ValueError if nothing's been recorded.
+    """
+    from squidpeek_lib.history import History
+    from squidpeek_lib.reportwriter import ReportWriter
+    history = History(db_path)
+    try:
+        periods = history.periods()
+        if not periods:
+            raise ValueError, "%s doesn't have anything recorded in it" % db_path
+        periods = history.periods(periods[-1][0] - days * 86400)
+        out = ReportWriter(output)
+        try:
+            trend_report(history, periods, urls, num_urls, out)
+        except:
+            out.abort()
+            raise
+        out.close()
+    finally:
+        history.close()
+
+def follow(path, out_dir, windows=(5, 60), num_urls=100, ignore_query=True,
+           debug=False, sketch_kb=None, poll=1.0, stats_dest=None,
+           stats_footer=False, sort='accesses', filters=None):
+    """
+    Follow the log at path as it grows (and is rotated), writing a report
+    on the last n minutes of it to out_dir for each n in windows; they're 
+    regenerated every minute, and when sent SIGUSR1. If stats_dest is set,
+    statistics are written there after each round of reports.
+    """
+    import signal
+    from squidpeek_lib.logfile import FollowingReader
+    from squidpeek_lib import stats
+    summary_args = {
+        'num_urls': num_urls,
+        'ignore_query': ignore_query,
+        'debug': debug,
+        'sketch_kb': sketch_kb,
+        'filters': filters,
+    }
+    recent = RollingSummary(max(windows), summary_args)
+    log = FollowingReader(path)
+    requested = []
+    signal.signal(signal.SIGUSR1, lambda signum, frame: requested.append(signum))
+    last_minute = None
+    while 1:
+        lines = log.read_lines()
+        if lines:
+            timer = stats.start('parse')
+            recent.add(lines)
+            stats.stop(timer)
+            stats.count('lines', len(lines))
         else:
-            key = line['url']
+            time.sleep(poll)
+        minute = int(time.time()) / RollingSummary.bucket_secs
+        if requested or minute != last_minute:
+            del requested[:]
+            last_minute = minute
+            for minutes in windows:
+                write_report(os.path.join(out_dir, "last-%i-minutes.html" % minutes),
+                             recent.summary(minutes), num_urls, ignore_query,
+                             stats_footer=stats_footer, sort=sort)
+            if stats_dest:
+                stats.dump(stats_dest)
+
+
+class LogSummary(object):
+    """
+    Per-URL aggregates for a log (or part of one). Summaries of adjacent
+    parts of a log can be merged, in order, to get the summary of the whole.
+
+    If sketch_kb is set, distinct URLs are estimated with a HyperLogLog
+    instead of being remembered, and a CountMinSketch of about that size
+    tightens the counts of the URLs being tracked; memory use is then fixed,
+    no matter how many URLs there are.
+
+    ICP and async lines (see skipped_tags) are skipped before they're 
+    parsed, as are lines that don't match filters, a dict of the arguments
+    to squidlog.line_filter() (e.g., {'methods': ['GET']}).
+    """
+    def __init__(self, num_urls=100, ignore_query=True, debug=False, sketch_kb=None,
+                 filters=None):
+        from squidpeek_lib.spacesaving import SpaceSaving
+        self.ignore_query = ignore_query
+        self.debug = debug
+        self.filters = filters or {}
+        if sketch_kb:
+            from squidpeek_lib.hyperloglog import HyperLogLog
+            from squidpeek_lib.countmin import CountMinSketch
+            self.urls = HyperLogLog()
+            self.sketch = CountMinSketch.from_size(sketch_kb)
+        else:
+            self.urls = set()
+            self.sketch = None
+        self.hot_urls = SpaceSaving(max(2000, 10*num_urls))
+        self.first_utime = None
+        self.last_utime = None
+        self.num_processed = 0
+        self.num_error = 0
+        self.num_skipped = 0 # lines that the filters skipped
+        self.errors = {} # parse error cause -> count
+
+    def parse(self, fh, start=0, end=None):
+        """
+        Summarise the lines in fh that start from byte offset start up to
+        end; fh has to be seekable if they're set. Regular files are 
+        memory-mapped.
+        """
+        from squidpeek_lib.squidlog import AccessParser as SquidAccessParser, \
+          MmapAccessParser, line_range, line_filter, is_regular_file
+        skip = line_filter(skipped_tags, **self.filters)
+        log = None
+        if is_regular_file(fh):
+            try:
+                log = MmapAccessParser(fh, start, end, debug=self.debug, skip=skip)
+            except EnvironmentError:
+                pass # fall back to reading it
+        if log is None:
+            if start or end is not None:
+                fh = line_range(fh, start, end)
+            log = SquidAccessParser(fh, debug=self.debug, skip=skip)
+        self._parse_lines(log)
+        self.num_processed += log.num_processed
+        self.num_error += log.num_error
+        self.num_skipped += log.num_skipped
+        for cause, num in log.errors.items():
+            self.errors[cause] = self.errors.get(cause, 0) + num
+
+    def _track(self, key, hash_key, count=1):
+        """
+        Count key, whose hashUrl() is hash_key; return its statistics,
+        creating them if it's new.
+        """
+        self.urls.add(hash_key)
+        if self.sketch is not None:
+            self.sketch.add(hash_key, count)
+        tmp = self.hot_urls.add(key, count)
+        if tmp is None:
+            if self.sketch is not None:
+                self.hot_urls.cap(key, self.sketch.estimate(hash_key))
+            tmp = self.hot_urls[key] = new_url_stats()
+        return tmp
+
+    def new_url_stats(self):
+        "Return an empty set of statistics for a URL (e.g., for summaryfile)."
+        return new_url_stats()
+
+    def _span(self, first_utime, last_utime):
+        """
+        Widen the time covered to include first_utime..last_utime, so that
+        logs can be summarised in any order (e.g., rotated files by name).
+        """
+        if first_utime is None:
+            return
+        if self.first_utime is None or first_utime < self.first_utime:
+            self.first_utime = first_utime
+        if self.last_utime is None or last_utime > self.last_utime:
+            self.last_utime = last_utime
+
+    def _parse_lines(self, log):
+        ignore_query = self.ignore_query
+        debug = self.debug
+        first_utime = last_utime = None
+        for line in log:
+            if first_utime == None: 
+                first_utime = line['utime']
+            last_utime = line['utime']
+            if line.has_key('extra_0'): # assume that the extra field is an url-encoded list of the Link header values. Not brilliant, but...
+                key = parse_link(urllib.unquote(line['extra_0']))
+                hash_key = hashUrl(key)
+                query_hash = ignore_query and hashUrl(line['url'])[:8]
+            else:
+                key, hash_key, query_hash = normalise(line['url'], ignore_query)
+            tmp = self._track(key, hash_key)
+            if 200 <= line['status'] < 300:
+                tmp['kbytes'].append(line['bytes'])
+            try:
+                tmp['status'][line['status'] / 100] += 1
+            except KeyError:
+                tmp['status'][line['status'] / 100] = 1
+            tmp['timeline'].add(line['utime'], 1, MISS in log_tags.get(line['log_tag'], ()),
+                                line['status'] >= 500)
+            try:
+                tag_types = log_tags[line['log_tag']]
+            except KeyError:
+                if debug:
+                    sys.stderr.write(
+                        "Unknown log tag %s (line %s)" % (
+                            line['log_tag'], log.num_processed
+                    ))
+                continue
+            if MISS in tag_types:
+                tmp['elapsed'].append(line['elapsed'])                
+            try:
+                for tag_type in tag_types:
+                    try:
+                        tmp['types'][tag_type] += 1
+                    except KeyError:
+                        tmp['types'][tag_type] = 1
+            except KeyError:
+                sys.stderr.write("Warning: unrecognised log tag: %s" % line['log_tag'])
             if ignore_query:
-                scheme, authority, path, query, fragment = urlparse.urlsplit(key)
-                path = "/".join([seg.split(";",1)[0] for seg in path.split('/')])
-                key = urlparse.urlunsplit((scheme, authority, path, '', ''))
-        hash_key = hashUrl(key)
-        urls[hash_key] = urls.get(hash_key, 0) + 1
-        tmp = hot_urls.get(key, {
-          'kbytes': Sparkogram(0,256),
-          'elapsed': Sparkogram(0,1000),
-          'status': {},
-          'types': {},
-          'query': {},
-          })
-        if 200 <= line['status'] < 300:
-            tmp['kbytes'].append(line['bytes'] / 1024.0)
+                count_query(tmp, query_hash)
+        self._span(first_utime, last_utime)
+
+    def compatible(self, other):
+        "Return whether other was made with settings that let it be merged."
+        if self.sketch is None or other.sketch is None:
+            sketches_match = self.sketch is other.sketch
+        else:
+            sketches_match = (self.sketch.width, self.sketch.depth) == \
+                             (other.sketch.width, other.sketch.depth)
+        return sketches_match and self.ignore_query == other.ignore_query \
+          and self.filters == other.filters
+
+    def merge(self, other, copy=False):
+        """
+        Fold the summary of another part of the log (or another log) into
+        this one. Per-URL statistics are taken over from other, unless copy
+        is set.
+        """
+        self._span(other.first_utime, other.last_utime)
+        self.num_processed += other.num_processed
+        self.num_error += other.num_error
+        self.num_skipped += other.num_skipped
+        for cause, num in other.errors.items():
+            self.errors[cause] = self.errors.get(cause, 0) + num
+        self.urls.update(other.urls)
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
+        self.hot_urls.merge(other.hot_urls, merge_url_stats, copy and copy_url_stats or None)
+
+class RollingSummary(object):
+    """
+    Summaries of the last few minutes of a log, one LogSummary(**summary_args) 
+    per minute in a ring; minutes that are too old to be reported on are 
+    dropped, so memory use stays steady.
+    """
+    bucket_secs = 60
+
+    def __init__(self, minutes, summary_args):
+        self.summary_args = summary_args
+        self.buckets = [None] * minutes # (bucket number, LogSummary)
+
+    def add(self, lines, now=None):
+        """
+        Summarise lines (without line endings) in the buckets for the 
+        minute they were logged in.
+        """
+        newest = self._expire(now)
+        run = []
+        run_bucket = newest
+        for line in lines:
+            try:
+                bucket = int(float(line.split(None, 1)[0])) / self.bucket_secs
+            except (ValueError, IndexError):
+                bucket = run_bucket # let the parser count the error
+            if bucket != run_bucket:
+                self._add(run_bucket, run, newest)
+                run = []
+                run_bucket = bucket
+            run.append(line)
+        self._add(run_bucket, run, newest)
+
+    def _add(self, bucket, lines, newest):
+        if not lines or bucket <= newest - len(self.buckets):
+            return # too old
+        bucket = min(bucket, newest) # clocks can disagree
+        slot = bucket % len(self.buckets)
+        if self.buckets[slot] is None or self.buckets[slot][0] < bucket:
+            self.buckets[slot] = (bucket, LogSummary(**self.summary_args))
+        elif self.buckets[slot][0] > bucket:
+            return
+        self.buckets[slot][1].parse(iter(lines))
+
+    def _expire(self, now=None):
+        "Drop buckets that have aged out, and return the current one."
+        if now is None:
+            now = time.time()
+        newest = int(now) / self.bucket_secs
+        for slot in range(len(self.buckets)):
+            if self.buckets[slot] and self.buckets[slot][0] <= newest - len(self.buckets):
+                self.buckets[slot] = None
+        return newest
+
+    def summary(self, minutes, now=None):
+        "Return a LogSummary of the last minutes minutes."
+        newest = self._expire(now)
+        summary = LogSummary(**self.summary_args)
+        for entry in self.buckets:
+            if entry and entry[0] > newest - minutes:
+                summary.merge(entry[1], copy=True)
+        return summary
+
+def url_key(url, ignore_query=True):
+    """
+    Return the key that url's statistics are kept under; if ignore_query is
+    set, that's the URL without its query string or path parameters.
+    """
+    if not ignore_query:
+        return url
+    scheme, authority, path, query, fragment = urlparse.urlsplit(url)
+    path = "/".join([seg.split(";",1)[0] for seg in path.split('/')])
+    return urlparse.urlunsplit((scheme, authority, path, '', ''))
+
+_url_caches = {} # ignore_query -> LRUCache of url -> normalise(url)
+url_cache_size = 20000
+
+def normalise(url, ignore_query=True):
+    """
+    Return url's key (see url_key), interned; the key's hashUrl(); and, if
+    ignore_query is set, the first eight bytes of url's own hashUrl(), for
+    counting its distinct queries. Recently seen URLs are remembered, so
+    that the busy ones are only parsed and hashed once.
+    """
+    try:
+        cache = _url_caches[ignore_query]
+    except KeyError:
+        from squidpeek_lib.lrucache import LRUCache
+        cache = _url_caches[ignore_query] = LRUCache(url_cache_size)
+    found = cache.get(url)
+    if found is None:
+        key = intern(url_key(url, ignore_query))
+        found = (key, hashUrl(key), ignore_query and hashUrl(url)[:8])
+        cache.set(url, found)
+    return found
+
+def new_url_stats():
+    "Return an empty set of statistics for a URL."
+    from squidpeek_lib.loghistogram import LogHistogram
+    from squidpeek_lib.timeline import Timeline
+    return {
+      'kbytes': LogHistogram(unit=1024),
+      'elapsed': LogHistogram(),
+      'timeline': Timeline(),
+      'status': {},
+      'types': {},
+      'query': {}, # query hash -> count; see count_query()
+      'query_distinct': None,
+      'query_sketch': None,
+      }
+
+def merge_url_stats(ours, theirs):
+    "Fold the statistics for a URL in theirs into ours."
+    ours['kbytes'].merge(theirs['kbytes'])
+    ours['elapsed'].merge(theirs['elapsed'])
+    ours['timeline'].merge(theirs['timeline'])
+    for name in ['status', 'types']:
+        for k, v in theirs[name].iteritems():
+            ours[name][k] = ours[name].get(k, 0) + v
+    merge_queries(ours, theirs)
+
+def copy_url_stats(stats):
+    "Return a copy of the statistics for a URL, by merging them into new ones."
+    ours = new_url_stats()
+    merge_url_stats(ours, stats)
+    return ours
+
+query_top_k = 256
+query_precision = 12 # of the HyperLogLog; 1.6% standard error, and usually within 3%
+query_sketch_size = (1024, 2) # width and depth of the CountMinSketch; 8k
+
+def count_query(stats, query_hash, count=1):
+    """
+    Count a query (by its hash) to a URL with stats. Up to query_top_k
+    distinct queries are counted exactly; after that, a SpaceSaving keeps
+    the most popular of them, a HyperLogLog estimates how many there are,
+    and a CountMinSketch tightens their counts, so that cache-busting URLs
+    don't take up more and more memory.
+    """
+    queries = stats['query']
+    distinct = stats['query_distinct']
+    if distinct is None:
+        if query_hash in queries:
+            queries[query_hash] += count
+            return
+        if len(queries) < query_top_k:
+            queries[query_hash] = count
+            return
+        queries, distinct = _sketch_queries(stats)
+    sketch = stats['query_sketch']
+    sketch.add(query_hash, count)
+    if query_hash in queries:
+        queries.add(query_hash, count)
+    else:
+        distinct.add(query_hash)
+        queries.add(query_hash, count)
+        queries.cap(query_hash, sketch.estimate(query_hash))
+
+def merge_queries(ours, theirs):
+    """
+    Fold the query counts for a URL in theirs into ours. Both sides' counts
+    are added up before the least popular are dropped, so the result is
+    the same whichever way round they're merged.
+    """
+    if ours['query_distinct'] is None and theirs['query_distinct'] is None:
+        queries = ours['query']
+        for query_hash, count in theirs['query'].iteritems():
+            queries[query_hash] = queries.get(query_hash, 0) + count
+        if len(queries) > query_top_k:
+            _sketch_queries(ours)
+        return
+    from squidpeek_lib.spacesaving import SpaceSaving
+    from squidpeek_lib.hyperloglog import HyperLogLog
+    from squidpeek_lib.countmin import CountMinSketch
+    sides = [_query_counts(ours), _query_counts(theirs)]
+    counts, errors = {}, {}
+    for query_hash in set(sides[0][0]) | set(sides[1][0]):
+        counts[query_hash] = errors[query_hash] = 0
+        for side_counts, side_errors, floor in sides:
+            # a query that a side isn't keeping could have been seen up to floor times
+            counts[query_hash] += side_counts.get(query_hash, floor)
+            errors[query_hash] += side_errors.get(query_hash, floor)
+    keep = _most_popular(counts)
+    if ours['query_distinct'] is None:
+        distinct = HyperLogLog(query_precision)
+        sketch = CountMinSketch(*query_sketch_size)
+        sources = [ours, theirs]
+    else:
+        distinct, sketch = ours['query_distinct'], ours['query_sketch']
+        sources = [theirs]
+    for stats in sources:
+        if stats['query_distinct'] is None:
+            for query_hash, count in stats['query'].iteritems():
+                distinct.add(query_hash)
+                sketch.add(query_hash, count)
+        else:
+            distinct.update(stats['query_distinct'])
+            sketch.merge(stats['query_sketch'])
+    ours['query'] = SpaceSaving.from_counts(query_top_k,
+        dict([(q, counts[q]) for q in keep]), dict([(q, errors[q]) for q in keep]),
+        floor=sides[0][2] + sides[1][2])
+    ours['query_distinct'] = distinct
+    ours['query_sketch'] = sketch
+
+def _query_counts(stats):
+    """
+    Return a URL's query counts, their errors, and how many times a query
+    that isn't counted could have been seen.
+    """
+    queries = stats['query']
+    if stats['query_distinct'] is None:
+        return queries, dict.fromkeys(queries, 0), 0
+    return queries.counts, queries.errors, queries.floor()
+
+def _most_popular(counts):
+    "Return the query_top_k keys with the highest counts (ties broken by key)."
+    keys = counts.keys()
+    keys.sort(key=lambda key: (-counts[key], key))
+    return keys[:query_top_k]
+
+def _query_tail(rest, first, last, high):
+    """
+    Spread rest accesses over the queries ranked first to last, which
+    aren't counted, and return (rank, accesses) for up to 100 runs of them.
+    Like the ones that are counted, they're taken to fall off as a power
+    law, starting from at most high accesses each.
+    """
+    tail = last - first + 1
+    step = max(1, tail / 100)
+    runs = [(rank, min(rank + step, last + 1) - rank) for rank in xrange(first, last + 1, step)]
+    top = max(first - 1, 1)
+    def shape(power):
+        return [size * ((rank + size / 2.0) / top) ** -power for rank, size in runs]
+    low_power, high_power = 0.0, 8.0
+    if high * sum(shape(low_power)) > rest:
+        for i in xrange(30):
+            power = (low_power + high_power) / 2
+            if high * sum(shape(power)) > rest:
+                low_power = power
+            else:
+                high_power = power
+    weights = shape(low_power)
+    total = sum(weights)
+    spread = []
+    so_far = 0.0
+    done = 0
+    for (rank, size), weight in zip(runs, weights):
+        so_far += weight
+        upto = int(round(rest * so_far / total))
+        spread.append((rank, upto - done))
+        done = upto
+    return spread
+
+def _extrapolate(counts, rank):
+    """
+    Fit a power law to counts (ranked from 1, most popular first), and
+    return what it gives for rank.
+    """
+    import math
+    points = [(math.log(i + 1), math.log(count)) for i, count in enumerate(counts) if count > 0]
+    if len(points) < 2:
+        return counts and counts[-1] or 0
+    mean_x = sum([x for x, y in points]) / len(points)
+    mean_y = sum([y for x, y in points]) / len(points)
+    spread = sum([(x - mean_x) ** 2 for x, y in points])
+    slope = sum([(x - mean_x) * (y - mean_y) for x, y in points]) / spread
+    return math.exp(mean_y + slope * (math.log(rank) - mean_x))
+
+def _sketch_queries(stats):
+    """
+    Switch stats' query counts to a SpaceSaving, a HyperLogLog and a
+    CountMinSketch, if they aren't already, and return the first two. The
+    most popular queries are added first, so that their counts stay exact.
+    """
+    if stats['query_distinct'] is not None:
+        return stats['query'], stats['query_distinct']
+    from squidpeek_lib.spacesaving import SpaceSaving
+    from squidpeek_lib.hyperloglog import HyperLogLog
+    from squidpeek_lib.countmin import CountMinSketch
+    counts = stats['query'].items()
+    counts.sort(key=lambda item: (-item[1], item[0]))
+    queries = SpaceSaving(query_top_k)
+    distinct = HyperLogLog(query_precision)
+    sketch = CountMinSketch(*query_sketch_size)
+    for query_hash, count in counts:
+        queries.add(query_hash, count)
+        distinct.add(query_hash)
+        sketch.add(query_hash, count)
+    stats['query'], stats['query_distinct'] = queries, distinct
+    stats['query_sketch'] = sketch
+    return queries, distinct
+
+
+def _summarise_range(args):
+    path, start, end, summary_args = args
+    from squidpeek_lib.logfile import open_log
+    fh = open_log(path)
+    try:
+        summary = LogSummary(**summary_args)
+        summary.parse(fh, start, end)
+    finally:
+        fh.close()
+    return summary
+
+def summarise_parallel(logs, jobs, summary_args, ranges=None):
+    """
+    Summarise logs (open files; from byte offset start to end of each, 
+    for the (start, end)s in ranges, if given) using jobs worker processes
+    with a LogSummary(**summary_args) each. Uncompressed files are split
+    into newline-aligned byte ranges for the workers; compressed ones are
+    handled by one worker each.
+    """
+    from multiprocessing import Pool
+    from squidpeek_lib.squidlog import byte_ranges, is_regular_file
+    if ranges is None:
+        ranges = [(0, None)] * len(logs)
+    work = []
+    for fh, (start, end) in zip(logs, ranges):
+        if is_regular_file(fh):
+            work.extend([(fh.name, part_start, part_end, summary_args)
+                for part_start, part_end in byte_ranges(fh.name, jobs, start, end)])
+        else:
+            work.append((fh.name, 0, None, summary_args))
+    pool = Pool(jobs)
+    try:
+        parts = pool.map(_summarise_range, work, 1)
+    finally:
+        pool.close()
+        pool.join()
+    summary = LogSummary(**summary_args)
+    for part in parts:
+        summary.merge(part)
+    return summary
+
+def time_range(fh, since=None, until=None, use_index=False):
+    """
+    Return the (start, end) byte offsets of the lines from since up to
+    until (in seconds since the epoch) in the log open as fh, a regular
+    file in time order, by bisecting it. If use_index is set, the search
+    starts from (and adds to) a TimeIndex kept next to the log.
+    """
+    from squidpeek_lib.squidlog import time_offset, TimeIndex
+    index = None
+    if use_index:
+        index = TimeIndex(fh.name + ".timeindex", fh)
+    start, end = 0, os.fstat(fh.fileno()).st_size
+    if since is not None:
+        start = time_offset(fh, since, start, end, index)
+    if until is not None:
+        end = time_offset(fh, until, start, end, index)
+    if index is not None:
         try:
-            tmp['status'][line['status'] / 100] += 1
-        except KeyError:
-            tmp['status'][line['status'] / 100] = 1
+            index.save()
+        except EnvironmentError, why:
+            sys.stderr.write("Can't save time index %s: %s\n" % (index.path, why))
+    return start, end
+
+time_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+time_formats = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]
+
+def parse_time(text, now=None):
+    """
+    Return the time in text, in seconds since the epoch: either that
+    number, a local date and time (e.g., "2013-09-24 05:20"), or a number 
+    of seconds, minutes, hours or days before now (e.g., "15m"). Raises
+    ValueError if it's none of them.
+    """
+    text = text.strip()
+    try:
+        if text[-1:] in time_units:
+            return (now or time.time()) - float(text[:-1]) * time_units[text[-1]]
+        return float(text)
+    except ValueError:
+        pass
+    for time_format in time_formats:
         try:
-            tag_types = log_tags[line['log_tag']]
-        except KeyError:
-            if debug:
-                sys.stderr.write(
-                    "Unknown log tag %s (line %s)" % (
-                        line['log_tag'], log.num_processed
-                ))
-            continue
-        if MISS in tag_types:
-            tmp['elapsed'].append(line['elapsed'])                
+            return time.mktime(time.strptime(text, time_format))
+        except ValueError:
+            pass
+    raise ValueError, "unrecognised time: %s" % text
+
+
+STATE_VERSION = 9
+
+def load_state(state_file, fh, summary):
+    """
+    Return the summary and byte offset saved in state_file, if it was
+    saved for the log open as fh with the same settings; otherwise, return
+    the given summary and 0, so that the log is read from the start.
+    """
+    from squidpeek_lib import summaryfile
+    saved = LogSummary(debug=summary.debug)
+    try:
+        state = summaryfile.read(state_file, saved)
+    except IOError:
+        return summary, 0
+    except Exception, why:
+        sys.stderr.write("Ignoring unreadable state file %s: %s\n" % (state_file, why))
+        return summary, 0
+    st = os.fstat(fh.fileno())
+    if state.get('version') != STATE_VERSION \
+      or state['inode'] != [st.st_dev, st.st_ino] \
+      or state['offset'] > st.st_size \
+      or not summary.compatible(saved):
+        return summary, 0 # rotated, truncated or different options
+    return saved, state['offset']
+
+def save_state(state_file, fh, summary, offset):
+    """
+    Atomically save summary, along with the log file's identity and the
+    offset it has been read to, to state_file.
+    """
+    from squidpeek_lib import summaryfile
+    st = os.fstat(fh.fileno())
+    summaryfile.write(state_file, summary, {
+        'version': STATE_VERSION,
+        'inode': [st.st_dev, st.st_ino],
+        'offset': offset,
+    })
+
+def load_summary(path):
+    """
+    Return the LogSummary saved in the file at path by save_summary(); 
+    raises ValueError if it isn't one, or is from another version.
+    """
+    from squidpeek_lib import summaryfile
+    summary = LogSummary()
+    if summaryfile.read(path, summary).get('version') != STATE_VERSION:
+        raise ValueError, "%s is from a different version of squidpeek" % path
+    return summary
+
+def save_summary(path, summary):
+    "Atomically save summary to the file at path, for load_summary()."
+    from squidpeek_lib import summaryfile
+    summaryfile.write(path, summary, {'version': STATE_VERSION})
+
+def record_history(db_path, summary):
+    """
+    Add aggregates for summary's hot URLs to the SQLite database at db_path
+    (see squidpeek_lib.history), as the period starting at its first line.
+    """
+    from squidpeek_lib.history import History
+    from squidpeek_lib import stats
+    if summary.first_utime is None:
+        return # nothing to record
+    hot_urls = summary.hot_urls
+    rows = []
+    for url in hot_urls.keys():
+        url_stats = hot_urls[url]
+        types = url_stats['types']
+        elapsed_median, elapsed_p95 = url_stats['elapsed'].percentiles([.5, .95])
+        kbytes = url_stats['kbytes']
+        rows.append((url, hot_urls.count(url), hot_urls.error(url), types.get(HIT, 0), 
+                     types.get(MISS, 0), url_stats['status'].get(5, 0), elapsed_median,
+                     elapsed_p95, kbytes.sum_seen, kbytes.percentile(.5)))
+    history = History(db_path)
+    try:
+        history.record(summary.first_utime, summary.last_utime, summary.num_processed,
+                       summary.num_error, len(summary.urls), rows)
+    finally:
+        history.close()
+    stats.count('history rows', len(rows))
+
+
+def write_report(path, summary, num_urls=100, ignore_query=True, jobs=1,
+                 stats_footer=False, sort='accesses'):
+    "Atomically replace the file at path with a report on summary."
+    from squidpeek_lib.reportwriter import ReportWriter
+    out = ReportWriter(path)
+    try:
+        report(summary, num_urls, ignore_query, jobs, out, stats_footer, sort)
+    except:
+        out.abort()
+        raise
+    out.close()
+
+
+sort_orders = {
+    # name: (description, function of a URL's statistics)
+    'accesses': ("accesses", None),
+    'misses': ("misses", lambda stats: stats['types'].get(MISS, 0)),
+    'bytes': ("kbytes served", lambda stats: stats['kbytes'].sum_seen),
+    'latency': ("95th percentile miss msec", 
+                lambda stats: stats['elapsed'].percentile(.95)),
+}
+
+def describe_filters(filters):
+    "Return a description of filters (see LogSummary), e.g. 'method GET or HEAD'."
+    descriptions = []
+    for option, name, description in filter_options:
+        if filters.get(name):
+            values = filters[name]
+            if name == 'status_classes':
+                values = ["%sxx" % value for value in values]
+            descriptions.append("%s %s" % (description, " or ".join(values)))
+    return "; ".join(descriptions)
+
+def rank(hot_urls, num_urls=100, sort='accesses'):
+    """
+    Return the num_urls keys in hot_urls that rank highest by sort (one of
+    sort_orders), highest first; ties go to the busier URL, and then to the
+    URL that sorts first, so that the report doesn't depend on the order the
+    URLs were counted in. Only the top num_urls are kept in order, in a heap.
+    """
+    import heapq
+    counts = hot_urls.counts
+    if sort == 'accesses':
+        key = counts.__getitem__
+    else:
+        value = sort_orders[sort][1]
+        values = hot_urls.values
+        key = lambda url: (value(values[url]), counts[url])
+    # nlargest keeps equal keys in the order they're given
+    urls = hot_urls.keys()
+    urls.sort()
+    return heapq.nlargest(num_urls, urls, key)
+
+
+def report(summary, num_urls=100, ignore_query=True, jobs=1, out=None,
+           stats_footer=False, sort='accesses'):
+    """
+    Write an HTML report on summary's top num_urls URLs (ranked by sort; see
+    sort_orders) to out (a ReportWriter; default: STDOUT), drawing their rows
+    with jobs processes. Rows are written as they're drawn. If stats_footer
+    is set, the run's statistics are shown at the end.
+    """
+    from squidpeek_lib.canvas import ImageSheet
+    from squidpeek_lib.reportwriter import ReportWriter
+    from squidpeek_lib import stats, canvas
+    if out is None:
+        stdout = ReportWriter()
         try:
-            for tag_type in tag_types:
-                try:
-                    tmp['types'][tag_type] += 1
-                except KeyError:
-                    tmp['types'][tag_type] = 1
-        except KeyError:
-            sys.stderr.write("Warning: unrecognised log tag: %s" % line['log_tag'])
-        if ignore_query:
-            hash_url = hashUrl(line['url'])[:8]
-            try:
-                tmp['query'][hash_url] += 1
-            except KeyError:
-                tmp['query'][hash_url] = 1
-        hot_urls[key] = tmp
+            report(summary, num_urls, ignore_query, jobs, stdout, stats_footer, sort)
+        finally:
+            stdout.flush()
+        return
+    sheet = ImageSheet()
+    urls = summary.urls
+    hot_urls = summary.hot_urls
+    if summary.sketch is None:
+        distinct = "%i" % len(urls)
+    else:
+        distinct = "about %i" % len(urls)
 
     # TODO: url diversity
 
-    url_list = hot_urls.keys()
-    url_list.sort(lambda a, b, u=urls: cmp(u[hashUrl(b)], u[hashUrl(a)]))
+    timer = stats.start('rank')
+    url_list = rank(hot_urls, num_urls, sort)
+    stats.stop(timer)
+    if sort == 'accesses':
+        showing = "%i" % num_urls
+    else:
+        showing = "%i by %s" % (num_urls, sort_orders[sort][0])
+    if summary.filters:
+        filtered = "\n          <li>Only lines with %s; %i lines skipped</li>" % (
+            cgi.escape(describe_filters(summary.filters)), summary.num_skipped)
+    else:
+        filtered = ""
+    if summary.first_utime is None: # e.g., the filters matched nothing
+        span = "\n          <li>No matching requests</li>"
+    else:
+        span = """
+          <li>Start: <strong>%s</strong></li>
+          <li>End: <strong>%s</strong></li>""" % (
+            time.ctime(summary.first_utime), time.ctime(summary.last_utime))
     
-    print """
+    out.write("""
     <html>
       <head>
         <style type="text/css">
-            body {
-                font-family: sans-serif;
-            }
-            th {
-                text-align: left;
-                background-color: 333;
-                color: white;
-                font-weight: normal;
-                padding: 1px 3px;
-            }
-            td {
-                text-align: right;
-            }
-            td.secondary {
-                background-color: #eee;
-            } 
-            tr:hover td {
-                background-color: #ffc;
-                color: black;
-            }
-            table { 
-                font-size: 75%%;
-            } 
-            th a {
-                color: white;
-                text-decoration: none;
-            }
-            .key {
-                width: 90%%;
-                max-width: 800px;
-            }
-            dt {
-                font-weight: bold;
-            }
-            .bg0 { background-color: #fff; color: #000; }
-            .bg1 { background-color: #eee; color: #000; }
-            .bg2 { background-color: #ddd; color: #000; }
-            .bg3 { background-color: #ccc; color: #000; }
-            .bg4 { background-color: #bbb; color: #000; }
-            .bg5 { background-color: #aaa; color: #000; }
-            .bg6 { background-color: #999; color: #fff; }
-            .bg7 { background-color: #888; color: #fff; }
-            .bg8 { background-color: #777; color: #fff; }
-            .bg9 { background-color: #666; color: #fff; }
-            .bg10 { background-color: #555; color: #fff; }
+%s
         </style>
         <title>Squidpeek: %s log lines / %s URLs</title>
       </head>
@@ -221,22 +1016,21 @@ def main(fh, num_urls=100, ignore_query=True, debug=False):
         <h1>Squidpeek</h1>
         <ul>
           <li>%s log lines analysed, %i parsing errors</li>
-          <li>%i distinct URLs seen, showing top %i</li>
-          <li>Start: <strong>%s</strong></li>
-          <li>End: <strong>%s</strong></li>
+          <li>%s distinct URLs seen, showing top %s</li>%s%s
         </ul>
         <p><em><a href="#key">Key</a></em></p>
         <table>
           
-    """ % ( log.num_processed,
-            len(urls),
-            log.num_processed, 
-            log.num_error, 
-            len(urls),
-            num_urls,
-            time.ctime(first_utime), 
-            time.ctime(line.get('utime', None)), 
-          )
+    \n""" % ( _style,
+            summary.num_processed,
+            distinct,
+            summary.num_processed, 
+            summary.num_error, 
+            distinct,
+            showing,
+            span,
+            filtered,
+          ))
     if ignore_query: 
         query_div_hdr = "<th colspan='2'>query diversity</th>"
     else:
@@ -251,112 +1045,45 @@ def main(fh, num_urls=100, ignore_query=True, debug=False):
   <th colspan='2'>miss msec</th>
   <th colspan='2'>kbytes</th>
   <th>status codes</th>
+  <th>traffic over time</th>
 """ % query_div_hdr
 
-    i = 0
-    for url in url_list[:num_urls]:
-        hash_url = hashUrl(url)
-        if i % 25 == 0:
-            print header_line
-        i += 1
-        access = urls[hash_url]
-        types = hot_urls[url]['types']
-        # accesses
-        print "<tr><th><a href='%s'>%s</a></th><td class='secondary'>%7i</td>" % (url, url[:max_url_len], access)
-
-        # query diversity
-        if ignore_query:
-            query_set = hot_urls[url]['query'].values()
-            query_ttl = float(sum(query_set))
-            query_set.sort()
-            query_set.reverse()
-            q_div = Sparkogram(0, access) # hack, hack, hack
-            qn = 1
-            for q in query_set:
-                for qc in xrange(q):
-                    q_div.append(qn)
-                qn += 1
-            img = q_div.img()
-            if img:
-                print """\
-    <td>%3i</td>
-    <td class='secondary'><img src='%s' title='most popular: %4i%% of accesses'/></td>
-    """ % (q_div.max_seen, img, (q_div.max_value / float(access) * 100))
-            else:
-                print "<td></td><td></td>"
-
-        # % hits
-        hit_pct = types.get(HIT, 0) / float(access) * 100
-        print "<td class='bg%s' title='%s hits'>%2.0f%%</td>" % (int(hit_pct) / 10, types.get(HIT, 0), hit_pct)
-        # hits
-        hits = Sparkbar()
-        stale_hit = types.get(STALE_HIT, 0)
-        negative_hit = types.get(NEGATIVE_HIT, 0)
-        memory_hit = types.get(MEMORY_HIT, 0)
-        disk_hit = types.get(HIT, 0) - stale_hit - negative_hit - memory_hit
-        if negative_hit:
-            hits.append(negative_hit, "negative hit", (128,32,32,255))
-        if disk_hit:
-            hits.append(disk_hit, "disk hit", (192,192,192,0))
-        if stale_hit:
-            hits.append(stale_hit, "stale hit", (160,160,32,255))
-        if memory_hit:
-            hits.append(memory_hit, "memory hit", (32,128,32,255))
-        print "<td class='secondary'>%s</td>" % hits.img()
-
-        # % misses
-        miss_pct = types.get(MISS, 0) / float(access) * 100
-        print "<td class='bg%s' title='%s misses'>%2.0f%%</td>" % (int(miss_pct) / 10, types.get(MISS, 0), miss_pct)
-        # misses
-        misses = Sparkbar()
-        no_cache = types.get(CLIENT_NOCACHE, 0)
-        validate_yes = types.get(SERVER_VALIDATE_YES, 0)
-        validate_no = types.get(SERVER_VALIDATE, 0) - validate_yes
-        no_validate = types.get(MISS, 0) - types.get(SERVER_VALIDATE, 0)
-        if no_cache:
-            misses.append(types.get(CLIENT_NOCACHE, 0), "client no-cache", (128,32,32,255))
-        if no_validate:
-            misses.append(no_validate, "no validator", (192,192,192,0))
-        if validate_no:
-            misses.append(validate_no, "validate unsuccessful", (160,160,32,255))
-        if validate_yes:
-            misses.append(validate_yes, "validate successful", (32,32,128,255))
-        print "<td class='secondary'>%s</td>" % misses.img()
-
-        # elapsed miss times
-        img = hot_urls[url]['elapsed'].img()
-        if img:
-            el = hot_urls[url]['elapsed']
-            print """\
-<td>%4i</td>
-<td class='secondary'><img src='%s' title='min: %2.0f msec\nmedian: %2.0f msec\nmax: %2.0f msec'/></td>""" % (
-             el.median, img, el.min_seen, el.median, el.max_seen)
-        else:
-            print "<td></td><td></td>"            
-
-        # bytes
-        img = hot_urls[url]['kbytes'].img()
-        if img:
-            by = hot_urls[url]['kbytes']
-            print """\
-<td>%3ik</td>
-<td class='secondary'><img src='%s' title='min: %2.0fk\nmedian: %2.0fk\nmax: %2.0fk'/></td>""" % (
-             by.median, img, by.min_seen, by.median, by.max_seen)
-        else:
-            print "<td></td><td></td>"
-
-        # status codes
-        status_codes = Sparkbar()
-        [status_codes.append(hot_urls[url]['status'][s], '%sxx' % s, status_colors.get(s, unknown_color)) for s in hot_urls[url]['status']]
-        print "<td class='secondary'>%s</td>" % status_codes.img()
-
-        print "</tr>"
-        del hot_urls[url]
-
-    print """
+    timer = stats.start('render')
+    images_before = canvas.images_drawn, canvas.images_reused
+    period = (summary.first_utime, summary.last_utime)
+    rows = [(url, hot_urls.count(url), hot_urls.error(url), hot_urls[url], ignore_query,
+             period) for url in url_list]
+    if jobs > 1 and len(rows) > 1:
+        from multiprocessing import Pool
+        pool = Pool(jobs, canvas.set_backend, (canvas.get_backend(),))
+        try:
+            drawn = pool.imap(_render_row, rows, max(1, len(rows) / (jobs * 8)))
+            _write_rows(out, drawn, header_line, sheet)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _write_rows(out, (_render_row(row) for row in rows), header_line, sheet)
+    stats.stop(timer)
+    stats.count('rows', len(rows))
+    stats.count('images drawn', canvas.images_drawn - images_before[0])
+    stats.count('images reused', canvas.images_reused - images_before[1])
+    stats.count('images in page', len(sheet.rules))
+    stats.count('images repeated in page', sheet.repeats)
+    stats.record('parse errors', summary.errors)
+    stats.record('lines skipped', summary.num_skipped)
+    stats.record('hot URL evictions', hot_urls.evictions)
+    stats.record('hot URLs', len(hot_urls))
+
+    out.write("""
 </table>
 
-<div class="key">
+<style type="text/css">
+%s
+</style>
+
+<div class="key">\n""" % sheet.css())
+    out.write("""
 <h2 id="key">Key</h2>
 
 <p>Each line in the results indicates the service statistics for one service URL. Most graphics can be 'moused over' to reveal more
@@ -366,10 +1093,14 @@ detailed statistics for an individual entry.</p>
 
 <p>This column shows how many acccesses that the URL received during the sample period. It does not include ICP or other 
 inter-cache traffic, nor does it include 'async' traffic caused by <tt>stale-while-revalidate</tt>.</p>
-"""
+
+<p>Only the busiest URLs are tracked in detail. When a URL starts being tracked after the log has begun, its count may be
+overestimated (by up to the count of the URL it replaced), and the other columns only cover the accesses since. Mousing
+over the count shows the range that the actual number of accesses falls within, or 'exact' if it is known precisely.</p>
+\n""")
 
     if ignore_query:
-        print """
+        out.write("""
 <h3>query diversity</h3>
 
 <p>This column shows how many different query arguments were seen for this URL to the left, and a graph of how popular they were 
@@ -378,7 +1109,8 @@ to the right.</p>
 <p>For example, if a URL <tt>http://example.com/foo</tt> has 1000 <tt>accesses</tt>, and a <tt>query diversity</tt> of 250, it means that 250 
 different combinations of queries to it were seen. For the purposes of calcuating these metrics, query strings and path parameters are both
 considered query arguments, so that both <tt>http://example.com/foo?bar</tt> and <tt>http://example.com/foo;baz=bat</tt> would be collpased 
-into the URL above (contributing to the 250 figure).</p>
+into the URL above (contributing to the 250 figure). Beyond the 256 most popular queries for a URL, this figure is estimated, usually to
+within 3%.</p>
 
 <p>The graph next to it shows how accesses to the queries are distributed; If there is a high peak on the left and a short tail <img style="background-color: #eee;" src='data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAFAAAAAUCAYAAAAa2LrXAAABCklEQVR4nGL8//8/g6Ki4v/79+8zMowCkgEAAAD//2IaaAcMdQAAAAD//xoNQAoBAAAA//8aDUAKAQAAAP//Gg1ACgEAAAD//xoNQAoBAAAA//+CByAjI8P/gXTIUAUAAAAA//8aTYEUAgAAAAD//xoNQAoBAAAA//9CCUBFRcXRbEwiAAAAAP//wkiBo4FIGgAAAAD//xrNwhQCAAAAAP//whqAo6mQeAAAAAD//xpNgRQCAAAAAP//whmAo6mQOAAAAAD//8KbAkcDkTAAAAAA//8imIVHAxE/AAAAAP//IqoMHA1E3AAAAAD//2IhViFyII6OXiMAAAAA//8arYUpBAAAAAD//wMAgZ0V1hUT8dEAAAAASUVORK5CYII=' title='most popular:   27% of accesses'/>, it means that
 most accesses went to a few query terms, while if there is a low peak and a long tail <img style="background-color: #eee;" src='data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAFAAAAAUCAYAAAAa2LrXAAABBElEQVR4nGL8//8/g6Ki4v/79+8zMowCkgEAAAD//2IaaAcMdQAAAAD//xoNQAoBAAAA//8aDUAKAQAAAP//Gg1ACgEAAAD//xoNQAoBAAAA//8aDUAKAQAAAP//Gg1ACgEAAAD//2KBMRQVFf/D2KNtQuIBAAAA//8aTYEUAgAAAAD//xoNQAoBAAAA//8aDUAKAQAAAP//whqAyOXhKMAPAAAAAP//YsElQc9AfPDgPoOCgiK9rCMZ4KtUAQAAAP//Gs3CFAIAAAAA//8aDUAKAQAAAP//Gg1ACgEAAAD//xoNQCIAvvoAAAAA//8aDUAKAQAAAP//Gg1ACgEAAAD//wMAXUMU7UJYLdQAAAAASUVORK5CYII=' title='most popular:    4% of accesses'/>, it means that the queries were distributed over a larger
@@ -387,9 +1119,9 @@ set of request-URIs. Mousing over the graph will show how much of the total acce
 <p>In general, a large query diversity means that traffic to a particular service is more difficult to cache; as the query diversity number 
 approaches the number of accesses, there is less for the cache to exploit, and the hit rate will go down. However, if a reasonble amount of traffic
 goes to the most popular query terms, it is still possible to achieve a decent hit rate.</p>
-"""
+\n""")
 
-    print """
+    out.write("""
 <h3>hits</h3>
 
 <p>This column shows the percentage of hits for this URL on the left, and a graph representing their distribution on the right.</p>
@@ -446,16 +1178,22 @@ unavoidable (the cache has to fill somehow), and in some situations are desirabl
 millisecond units. This indicates how quickly upstream servers are able to send a response.</p>
 
 <p>Note that the times shown are measured from the first request write <tt>read()</tt> to the last response byte <tt>write()</tt>; 
-therefore, slow clients can inflate this number if TCP buffers are filled. If the median is '1000', it indicates that the median 
-is outside the measured range, and is likely to be greater.</p>
+therefore, slow clients can inflate this number if TCP buffers are filled. Miss times over a second are shown as a red line
+at the right of the histogram.</p>
+
+<p>Mousing over the histogram shows the minimum, median, 90th, 95th and 99th percentile, and maximum miss times. These
+are accurate to within about 2%, however long the miss times are.</p>
 
 <h3>kbytes</h3>
 
 <p>This column shows the median size (in kilobytes) of successful (2xx) responses served to clients, as well as a 256k-wide 
 histogram of responses sizes on the right.</p>
 
-<p>Note that the sizes shown are actual bytes served, including headers, compression, etc. If the median is '256', it indicates
-that the median is at least that amount.</p>
+<p>Note that the sizes shown are actual bytes served, including headers, compression, etc. Sizes over 256k are shown as
+a red line at the right of the histogram.</p>
+
+<p>Mousing over the histogram shows the minimum, median, 90th, 95th and 99th percentile, and maximum sizes. These
+are accurate to within about 2%, however large the responses are.</p>
 
 <h3>status codes</h3>
 
@@ -479,8 +1217,386 @@ that the median is at least that amount.</p>
        <dd><em>Server errors</em> -- problems on the origin server and/or upstream proxies. 
        A large number indicates that there are frequent upstream failures.</dd>
 </dl>
+
+<h3>traffic over time</h3>
+
+<p>This column shows how requests for the URL were spread over the time the report covers, in grey, with misses (blue) and 
+<tt>5xx</tt> responses (red) drawn over them. Each column is a minute, or more when the report covers more than an hour or so; mousing
+over the graph shows the URL's busiest period.</p>
+</div>
+""")
+    if stats_footer:
+        out.write("<div class='key'>\n<h2>Run statistics</h2>\n%s\n</div>\n" % stats.html())
+    out.write("</body></html>\n")
+
+_style = """\
+            body {
+                font-family: sans-serif;
+            }
+            th {
+                text-align: left;
+                background-color: 333;
+                color: white;
+                font-weight: normal;
+                padding: 1px 3px;
+            }
+            td {
+                text-align: right;
+            }
+            td.secondary {
+                background-color: #eee;
+            } 
+            tr:hover td {
+                background-color: #ffc;
+                color: black;
+            }
+            table { 
+                font-size: 75%;
+            } 
+            th a {
+                color: white;
+                text-decoration: none;
+            }
+            .key {
+                width: 90%;
+                max-width: 800px;
+            }
+            dt {
+                font-weight: bold;
+            }
+            .bg0 { background-color: #fff; color: #000; }
+            .bg1 { background-color: #eee; color: #000; }
+            .bg2 { background-color: #ddd; color: #000; }
+            .bg3 { background-color: #ccc; color: #000; }
+            .bg4 { background-color: #bbb; color: #000; }
+            .bg5 { background-color: #aaa; color: #000; }
+            .bg6 { background-color: #999; color: #fff; }
+            .bg7 { background-color: #888; color: #fff; }
+            .bg8 { background-color: #777; color: #fff; }
+            .bg9 { background-color: #666; color: #fff; }
+            .bg10 { background-color: #555; color: #fff; }"""
+
+_row_template = """\
+<tr><th><a href='%(url)s'>%(short_url)s</a></th><td class='secondary' title='%(accuracy)s'>%(access)7i</td>
+%(query)s<td class='bg%(hit_class)i' title='%(hits)i hits'>%(hit_pct)2.0f%%</td>
+<td class='secondary'>%(hit_img)s</td>
+<td class='bg%(miss_class)i' title='%(misses)i misses'>%(miss_pct)2.0f%%</td>
+<td class='secondary'>%(miss_img)s</td>
+%(elapsed)s%(kbytes)s<td class='secondary'>%(status_img)s</td>
+<td class='secondary'>%(timeline_img)s</td>
+</tr>
+"""
+_query_cells = """\
+    <td>%3i</td>
+    <td class='secondary'>%s</td>
+    
+"""
+_elapsed_cells = "<td>%4i</td>\n<td class='secondary'>%s</td>\n"
+_kbytes_cells = "<td>%3ik</td>\n<td class='secondary'>%s</td>\n"
+_empty_cells = "<td></td><td></td>\n"
+_row_images = [('query', _query_cells), ('hit_img', None), ('miss_img', None), 
+               ('elapsed', _elapsed_cells), ('kbytes', _kbytes_cells), 
+               ('status_img', None), ('timeline_img', None)]
+
+def _write_rows(out, rows, header_line, sheet):
+    """
+    Write rows from render_row to out, in order, adding their images to
+    sheet.
+    """
+    img = sheet.img
+    for i, row in enumerate(rows):
+        if i % 25 == 0:
+            out.write(header_line + "\n")
+        for name, cells in _row_images: # in the order they appear
+            value = row[name]
+            if cells is None:
+                row[name] = img(*value)
+            elif value is None:
+                row[name] = _empty_cells
+            elif value:
+                row[name] = cells % (value[0], img(*value[1]))
+        out.write(_row_template % row)
+
+def _render_row(args):
+    return render_row(*args)
+
+def render_row(url, access, error, stats, ignore_query=True, period=None):
+    """
+    Return a dict of the values in the report's row for url, from its stats;
+    period is the (first, last) time that the report covers.
+    Images are drawn, and left as (uri, title, width, height) tuples. Drawing
+    is the slow part, so this can be done in other processes, leaving the
+    images to be put into an ImageSheet in rank order.
+    """
+    from squidpeek_lib.sparkogram import Sparkogram
+    from squidpeek_lib.sparkbar import Sparkbar
+    counted = access - error # the accesses that the statistics below cover
+    types = stats['types']
+    row = {
+        'url': url,
+        'short_url': url[:max_url_len],
+        'access': access,
+        'query': '',
+    }
+    # accesses
+    if error:
+        row['accuracy'] = "between %i and %i accesses" % (counted, access)
+    else:
+        row['accuracy'] = "exact"
+
+    # query diversity
+    if ignore_query:
+        queries = stats['query']
+        if stats['query_distinct'] is None:
+            query_set = queries.values()
+            distinct = rest = floor = 0
+        else:
+            # the most popular ones have been seen at least count - error
+            # times, and at most count times or what the sketch says; the
+            # ones that can't be told apart from those that aren't counted
+            # (which have each been seen at most floor times) are spread
+            # over the rest, with them
+            distinct = min(len(stats['query_distinct']), counted)
+            sketch = stats['query_sketch']
+            total = sketch.total()
+            floor = queries.floor()
+            query_set = []
+            for q in queries.keys():
+                low = queries.count(q) - queries.error(q)
+                if low > floor:
+                    high = min(queries.count(q), sketch.estimate(q))
+                    query_set.append(max(low, min(high, sketch.estimate_mean(q, total))))
+            rest = min(total - sum(query_set), floor * max(distinct - len(query_set), 0))
+        query_set.sort()
+        query_set.reverse()
+        distinct = max(distinct, len(query_set))
+        q_div = Sparkogram(0, counted) # hack, hack, hack
+        qn = 1
+        for q in query_set:
+            q_div.append(qn, q)
+            qn += 1
+        # the less popular ones are estimated; spread the rest over them
+        if rest > 0 and distinct >= qn:
+            high = min(floor, _extrapolate(query_set, qn))
+            for first, count in _query_tail(rest, qn, distinct, high):
+                q_div.append(first, count)
+        img = q_div.img()
+        if img:
+            row['query'] = (distinct, (img, 'most popular: %4i%% of accesses' % (
+                q_div.max_value / float(counted) * 100), 80, 20))
+        else:
+            row['query'] = None
+
+    # % hits
+    row['hits'] = types.get(HIT, 0)
+    row['hit_pct'] = hit_pct = types.get(HIT, 0) / float(counted) * 100
+    row['hit_class'] = int(hit_pct) / 10
+    # hits
+    hits = Sparkbar()
+    stale_hit = types.get(STALE_HIT, 0)
+    negative_hit = types.get(NEGATIVE_HIT, 0)
+    memory_hit = types.get(MEMORY_HIT, 0)
+    disk_hit = types.get(HIT, 0) - stale_hit - negative_hit - memory_hit
+    if negative_hit:
+        hits.append(negative_hit, "negative hit", (128,32,32,255))
+    if disk_hit:
+        hits.append(disk_hit, "disk hit", (192,192,192,0))
+    if stale_hit:
+        hits.append(stale_hit, "stale hit", (160,160,32,255))
+    if memory_hit:
+        hits.append(memory_hit, "memory hit", (32,128,32,255))
+    row['hit_img'] = hits.image()
+
+    # % misses
+    row['misses'] = types.get(MISS, 0)
+    row['miss_pct'] = miss_pct = types.get(MISS, 0) / float(counted) * 100
+    row['miss_class'] = int(miss_pct) / 10
+    # misses
+    misses = Sparkbar()
+    no_cache = types.get(CLIENT_NOCACHE, 0)
+    validate_yes = types.get(SERVER_VALIDATE_YES, 0)
+    validate_no = types.get(SERVER_VALIDATE, 0) - validate_yes
+    no_validate = types.get(MISS, 0) - types.get(SERVER_VALIDATE, 0)
+    if no_cache:
+        misses.append(types.get(CLIENT_NOCACHE, 0), "client no-cache", (128,32,32,255))
+    if no_validate:
+        misses.append(no_validate, "no validator", (192,192,192,0))
+    if validate_no:
+        misses.append(validate_no, "validate unsuccessful", (160,160,32,255))
+    if validate_yes:
+        misses.append(validate_yes, "validate successful", (32,32,128,255))
+    row['miss_img'] = misses.image()
+
+    # elapsed miss times
+    el = stats['elapsed']
+    img = el.img(1000)
+    if img:
+        p90, p95, p99 = el.percentiles([.9, .95, .99])
+        row['elapsed'] = (el.median, (img, 
+          'min: %2.0f msec\nmedian: %2.0f msec\n90%%: %2.0f msec\n95%%: %2.0f msec\n99%%: %2.0f msec\nmax: %2.0f msec' % (
+             el.min_seen, el.median, p90, p95, p99, el.max_seen), 80, 20))
+    else:
+        row['elapsed'] = None
+
+    # bytes
+    by = stats['kbytes']
+    img = by.img(256)
+    if img:
+        p90, p95, p99 = by.percentiles([.9, .95, .99])
+        row['kbytes'] = (by.median, (img, 
+          'min: %2.0fk\nmedian: %2.0fk\n90%%: %2.0fk\n95%%: %2.0fk\n99%%: %2.0fk\nmax: %2.0fk' % (
+             by.min_seen, by.median, p90, p95, p99, by.max_seen), 80, 20))
+    else:
+        row['kbytes'] = None
+
+    # status codes
+    status_codes = Sparkbar()
+    [status_codes.append(stats['status'][s], '%sxx' % s, status_colors.get(s, unknown_color)) for s in stats['status']]
+    row['status_img'] = status_codes.image()
+
+    # traffic over time
+    timeline = stats['timeline']
+    peak, peak_utime = timeline.peak()
+    if period is None or period[0] is None:
+        period = peak_utime, peak_utime
+    if timeline.width == 60:
+        busiest = "minute"
+    else:
+        busiest = "%i minutes" % (timeline.width / 60)
+    row['timeline_img'] = (timeline.img(*period), 'busiest %s: %i requests from %s' % (
+         busiest, peak, time.strftime("%a %H:%M", time.localtime(peak_utime))), 80, 20)
+    return row
+
+def trend_report(history, periods, urls=None, num_urls=100, out=None):
+    """
+    Write an HTML report to out (a ReportWriter) on how URLs changed over
+    periods, a list of (period, period_end) in history; see trends().
+    """
+    from squidpeek_lib.canvas import ImageSheet
+    sheet = ImageSheet()
+    since = periods[0][0]
+    latest, latest_end = periods[-1]
+    out.write("""
+    <html>
+      <head>
+        <style type="text/css">
+%s
+        </style>
+        <title>Squidpeek trends: %i periods</title>
+      </head>
+      <body>
+        <h1>Squidpeek trends</h1>
+        <ul>
+          <li>%i periods recorded from <strong>%s</strong> to <strong>%s</strong></li>
+          <li>Latest: <strong>%s</strong> to <strong>%s</strong></li>
+        </ul>
+        <p><em><a href="#key">Key</a></em></p>
+    \n""" % (_style, len(periods), len(periods), time.ctime(since), time.ctime(latest_end),
+             time.ctime(latest), time.ctime(latest_end)))
+    if urls:
+        sections = [("URLs", urls)]
+    else:
+        sections = [
+          ("Top %i movers" % num_urls, [m[0] for m in history.movers(since, num_urls)]),
+          ("Top %i busiest" % num_urls, history.busiest(since, num_urls)),
+        ]
+    for title, section_urls in sections:
+        out.write("<h2>%s</h2>\n<table>\n" % title)
+        if not section_urls:
+            out.write("<tr><td>Nothing to compare yet.</td></tr>\n")
+        for i, url in enumerate(section_urls):
+            if i % 25 == 0:
+                out.write(_trend_header)
+            row = trend_row(url, history.trend(url, since), periods)
+            row['timeline_img'] = sheet.img(*row['timeline_img'])
+            out.write(_trend_template % row)
+        out.write("</table>\n")
+    out.write("""
+<style type="text/css">
+%s
+</style>
+
+<div class="key">
+<h2 id="key">Key</h2>
+
+<p>Each line shows how one URL's traffic has changed, from the summaries recorded with <tt>--db</tt>. <em>Top movers</em>
+are the URLs whose accesses per hour changed the most between the latest period and the ones before it; <em>busiest</em>
+are the URLs with the most accesses over all of them.</p>
+
+<h3>accesses/hour</h3>
+
+<p>The average number of accesses per hour in the periods before the latest one, and in the latest one, followed by the change
+between them. URLs that were only tracked in some periods count as having no accesses in the others.</p>
+
+<h3>hits</h3>
+
+<p>The percentage of hits in the periods before the latest one, and in the latest one.</p>
+
+<h3>traffic over time</h3>
+
+<p>Accesses to the URL in each period, in grey, with misses (blue) and <tt>5xx</tt> responses (red) drawn over them.</p>
 </div>
-</body></html>"""
+</body></html>
+""" % sheet.css())
+
+_trend_header = """\
+<tr>
+  <th>url</th>
+  <th colspan='3'>accesses/hour</th>
+  <th colspan='2'>hits</th>
+  <th>traffic over time</th>
+</tr>
+"""
+_trend_template = """\
+<tr><th><a href='%(url)s'>%(short_url)s</a></th><td>%(before)7.1f</td><td>%(latest)7.1f</td>
+<td class='secondary'>%(change)s</td><td>%(hits_before)s</td><td>%(hits_latest)s</td>
+<td class='secondary'>%(timeline_img)s</td>
+</tr>
+"""
+
+def trend_row(url, rows, periods):
+    """
+    Return a dict of the values in the trends report's row for url, from
+    its rows in the history over periods. The image is left as a 
+    (uri, title, width, height) tuple.
+    """
+    from squidpeek_lib.timeline import Timeline
+    latest, latest_end = periods[-1]
+    before = {'accesses': 0, 'counted': 0, 'hits': 0}
+    now = before.copy()
+    timeline = Timeline(width=3600)
+    for history_row in rows:
+        counted = history_row['accesses'] - history_row['error']
+        if history_row['period'] == latest:
+            sums = now
+        else:
+            sums = before
+        sums['accesses'] += history_row['accesses']
+        sums['counted'] += counted
+        sums['hits'] += history_row['hits']
+        timeline.add(history_row['period'], counted, history_row['misses'], 
+                     history_row['server_errors'])
+    before_secs = sum([end - start for start, end in periods[:-1]])
+    row = {
+        'url': url,
+        'short_url': url[:max_url_len],
+        'before': before['accesses'] * 3600.0 / max(before_secs, 1),
+        'latest': now['accesses'] * 3600.0 / max(latest_end - latest, 1),
+    }
+    if row['before']:
+        row['change'] = "%+.0f%%" % ((row['latest'] / row['before'] - 1) * 100)
+    elif row['latest']:
+        row['change'] = "new"
+    else:
+        row['change'] = ""
+    for name, sums in [('hits_before', before), ('hits_latest', now)]:
+        if sums['counted']:
+            row[name] = "%2.0f%%" % (sums['hits'] / float(sums['counted']) * 100)
+        else:
+            row[name] = ""
+    row['timeline_img'] = (timeline.img(periods[0][0], latest_end), 
+      'recorded in %i of %i periods' % (len(rows), len(periods)), 80, 20)
+    return row
 
 def hashUrl(url):
     return hashlib.md5(url).digest()
@@ -520,78 +1636,70 @@ def parse_link(instr):
     return out
 
 
-# freaking RHL doesn't do Python greater than 2.3, so we
-# have to do some of it ourselves. Hmph.
-
-from itertools import islice, repeat, count, imap, izip 
-from heapq import heapify, heappop
-
-def tee(iterable):
-    def gen(next, data={}, cnt=[0]):
-        for i in count():
-            if i == cnt[0]:
-                item = data[i] = next()
-                cnt[0] += 1
-            else:
-                item = data.pop(i)
-            yield item
-    it = iter(iterable)
-    return (gen(it.next), gen(it.next))
-
-def nsmallest(n, iterable, key=None):
-    in1, in2 = tee(iterable)
-    it = izip(imap(key, in1), count(), in2)                 # decorate
-    h = list(it)
-    heapify(h)
-    result = map(heappop, repeat(h, min(n, len(h))))
-#    return map(itemgetter(2), result)                       # undecorate
-    return [x[2] for x in result]
-
-class CacheDict(UserDict):
-    def __init__(self, urls, max_size=1000, trim_to=.8, **args):
-        UserDict.__init__(self, **args)
-        self.urls = urls
-        self.max_size = max_size
-        self.trim_size = max_size * trim_to
-
-    def __getitem__(self, key):
-        return self.data[key][0]
-        
-    def __setitem__(self, key, value):
-        self.data[key] = (value, len(self.data))
-        if len(self.data) > self.max_size:
-            self.trim()
-
-    def trim(self):
-        expired = nsmallest(self.max_size - int(self.trim_size), self.data, self.getkey)
-        for key in expired:
-            del self.data[key]
-
-    def getkey(self, key):
-        return self.urls[hashUrl(key)]
-
 def usage():
     print """\
-Usage: %s [-n num] [-q] logfile 
+Usage: %s [-n num] [-q] [-j num] [-o file] [--sort order] [--stats file] [--state file | --follow dir] logfile ...
+       %s [options] [--since time] [--until time] [--time-index] logfile ...
+       %s [options] --summarize file logfile ...
+       %s [options] --merge summary ...
+       %s [-n num] [-o file] [--days num] --db file --trends [url ...]
           -d      Debug parse errors
+          -j num  Number of processes to parse and draw with (default: 1)
           -n num  Number of URLs to report (default: 100)
+          -o file Write the report to file (replacing it when done) instead of STDOUT
           -q      Use the query string as part of the URI
-         logfile  Squid access log, or '-' for STDIN
-""" % sys.argv[0]
+  --follow dir    Follow logfile as it grows, writing reports to dir
+  --images type   Draw sparklines as png, svg or pil (PNG using PIL); default png
+  --windows mins  Minutes to report on when following (default: 5,60)
+  --sort order    Rank URLs by accesses (default), misses, bytes or latency
+                  (95th percentile miss time)
+  --sketch kbytes Estimate URL counts in fixed memory, using about kbytes
+  --state file    Save progress in file, and resume from it next time
+  --since time    Only report on lines from time on: seconds since the epoch,
+                  "YYYY-MM-DD HH:MM[:SS]", or a number of s, m, h or d ago
+                  (e.g., 15m); logfiles have to be uncompressed
+  --until time    Only report on lines before time
+  --time-index    Keep checkpoints in logfile.timeindex, to find times faster
+  --method list   Only count requests with these methods (e.g., GET,HEAD)
+  --host list     ... for these hosts (or host:port), in any case; *.example.com for its subdomains
+  --url-prefix list ... for URLs starting with these
+  --client list   ... from these client addresses or IPv4 subnets (e.g., 10.0.0.0/8)
+  --status list   ... with these status classes (e.g., 4xx,5xx)
+  --log-tag list  ... with these log tags (e.g., TCP_MISS,TCP_REFRESH_MISS)
+  --summarize file Save a summary of the logs to file, for --merge, instead of reporting
+  --merge         Report on summaries saved by --summarize (e.g., on several proxies)
+  --db file       Also record per-URL aggregates in the SQLite database file
+  --trends        Report on how URLs have changed, from the database given to --db
+  --days num      Days of history to report on with --trends (default: 7)
+  --stats file    Write timings and counters to file as JSON ('-' for STDERR)
+  --stats-footer  Show timings and counters at the end of the report
+         logfile  Squid access log(s) or glob patterns, or '-' for STDIN;
+                  gzip, bzip2 and xz compressed logs are read transparently
+""" % (sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0], sys.argv[0])
     sys.exit(1)
 
 if __name__ == '__main__':
     import getopt
-    opts, args = getopt.getopt(sys.argv[1:], "dqn:")
+    from squidpeek_lib.logfile import open_log, expand_paths
+    from squidpeek_lib.squidlog import is_regular_file, line_filter
+    opts, args = getopt.getopt(sys.argv[1:], "dqn:j:o:", ["sketch=", "state=", "follow=", "windows=", "images=", "stats=", "stats-footer", "sort=", "summarize=", "merge", "db=", "trends", "days=", "since=", "until=", "time-index"] +
+                               [option[2:] + "=" for option, name, description in filter_options])
     opts = dict(opts)
-    try:
-        fh = open(args[0])
-    except IndexError:
+    merging = opts.has_key('--merge')
+    trending = opts.has_key('--trends')
+    if not args and not trending:
         usage()
-    except IOError, msg:
-        if args[0] == '-':
-            fh = sys.stdin
-        else:
+    if trending:
+        paths = args # they're URLs
+    else:
+        paths = expand_paths(args)
+    logs = []
+    for path in paths:
+        if merging or trending:
+            break
+        try:
+            logs.append(open_log(path))
+        except IOError, msg:
             sys.stderr.write("IO Error: %s\n" % msg)
             sys.exit(1)
     if opts.has_key('-d'):
@@ -606,7 +1714,121 @@ if __name__ == '__main__':
         ignore_query = False
     else:
         ignore_query = True
+    if opts.has_key('-j'):
+        jobs = int(opts['-j'])
+        if jobs > 1 and '-' in paths:
+            sys.stderr.write("Can't use -j with STDIN\n")
+            sys.exit(1)
+    else:
+        jobs = 1
+    state_file = opts.get('--state', None)
+    summary_file = opts.get('--summarize', None)
+    db_path = opts.get('--db', None)
+    if db_path:
+        try:
+            import sqlite3
+        except ImportError:
+            sys.stderr.write("--db needs Python's sqlite3 module\n")
+            sys.exit(1)
+    if trending and (not db_path or [o for o in ['--merge', '--state', '--follow', '--summarize']
+                                     if opts.has_key(o)]):
+        sys.stderr.write("--trends needs --db, and can't be used with --merge, --state, --follow or --summarize\n")
+        sys.exit(1)
     try:
-        main(fh, num_urls, ignore_query, debug)
+        days = float(opts.get('--days', 7))
+    except ValueError:
+        usage()
+    if merging and [o for o in ['--state', '--follow', '--summarize'] if opts.has_key(o)]:
+        sys.stderr.write("--merge can't be used with --state, --follow or --summarize\n")
+        sys.exit(1)
+    if state_file and (len(logs) > 1 or not is_regular_file(logs[0])):
+        sys.stderr.write("--state needs a single, uncompressed log file\n")
+        sys.exit(1)
+    try:
+        since = until = None
+        if opts.has_key('--since'):
+            since = parse_time(opts['--since'])
+        if opts.has_key('--until'):
+            until = parse_time(opts['--until'])
+    except ValueError, msg:
+        sys.stderr.write("%s\n" % msg)
+        sys.exit(1)
+    time_index = opts.has_key('--time-index')
+    filters = {}
+    for option, name, description in filter_options:
+        if opts.has_key(option):
+            filters[name] = [value.strip() for value in opts[option].split(',') if value.strip()]
+    if filters.has_key('status_classes'):
+        filters['status_classes'] = [value.lower().rstrip('x') for value in filters['status_classes']]
+    try:
+        line_filter(**filters)
+    except ValueError, msg:
+        sys.stderr.write("%s\n" % msg)
+        sys.exit(1)
+    if since is not None or until is not None:
+        if merging or trending or state_file or opts.has_key('--follow'):
+            sys.stderr.write("--since and --until can't be used with --merge, --trends, --state or --follow\n")
+            sys.exit(1)
+        if [fh for fh in logs if not is_regular_file(fh)]:
+            sys.stderr.write("--since and --until need uncompressed log files\n")
+            sys.exit(1)
+    if opts.has_key('--sketch'):
+        sketch_kb = int(opts['--sketch'])
+    else:
+        sketch_kb = None
+    if opts.has_key('--images'):
+        from squidpeek_lib import canvas
+        try:
+            canvas.set_backend(opts['--images'])
+        except ValueError:
+            usage()
+        except ImportError:
+            sys.stderr.write("--images pil needs PIL; see http://www.pythonware.com/products/pil/\n")
+            sys.exit(1)
+    out_dir = opts.get('--follow', None)
+    if out_dir:
+        if len(logs) > 1 or not is_regular_file(logs[0]) or jobs > 1 or state_file \
+          or summary_file or db_path:
+            sys.stderr.write("--follow needs a single, uncompressed log file, without -j, --state, --summarize or --db\n")
+            sys.exit(1)
+        try:
+            windows = [int(w) for w in opts.get('--windows', '5,60').split(',')]
+        except ValueError:
+            usage()
+        logs[0].close()
+    sort = opts.get('--sort', 'accesses')
+    if not sort_orders.has_key(sort):
+        usage()
+    stats_dest = opts.get('--stats', None)
+    stats_footer = opts.has_key('--stats-footer')
+    if stats_dest or stats_footer:
+        from squidpeek_lib import stats
+        stats.enable()
+        # per-line work in this process; wall time only
+        stats.instrument(globals(), 'url_key', 'normalise URLs')
+        stats.instrument(globals(), 'hashUrl', 'hash URLs')
+    try:
+        if out_dir:
+            follow(paths[0], out_dir, windows, num_urls, ignore_query, debug, sketch_kb,
+                   stats_dest=stats_dest, stats_footer=stats_footer, sort=sort, filters=filters)
+        elif trending:
+            trends(db_path, paths, num_urls, days, opts.get('-o', None))
+        elif merging:
+            merge(paths, num_urls, ignore_query, jobs, sketch_kb, opts.get('-o', None),
+                  stats_footer, sort, db_path, filters)
+        else:
+            main(logs, num_urls, ignore_query, debug, jobs, state_file, sketch_kb,
+                 opts.get('-o', None), stats_footer, sort, summary_file, db_path, since,
+                 until, time_index, filters)
+        if stats_dest and not out_dir:
+            stats.dump(stats_dest)
+    except ValueError, msg:
+        if not (merging or trending):
+            raise
+        sys.stderr.write("%s\n" % msg)
+        sys.exit(1)
+    except IOError, msg:
+        sys.stderr.write("IO Error: %s\n" % msg)
+        sys.exit(1)
     except KeyboardInterrupt:
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)